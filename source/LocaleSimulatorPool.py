@@ -0,0 +1,152 @@
+import multiprocessing
+
+import numpy as np
+
+from interface import Simulator, ActionSpace
+from VectorTransplanSimulator import VectorTransplanSimulator
+from helper.samplers import EmpiricalSampler
+
+
+# Pool of vectorized simulators, one worker process per locale of the MTurk logs (data/EXP2_data).
+# Step requests are sent to all workers before any answer is read, so that locales are stepped in parallel.
+
+LOCALES = ["ar-sa", "de-de", "en-gb", "es-mx", "fr-fr"]
+
+def _worker(connection, locale, num_envs, seed_sequence, simulator_kwargs):
+    rng = np.random.Generator(np.random.PCG64(seed_sequence))
+    simulator = VectorTransplanSimulator(rng, num_envs=num_envs, sampler=EmpiricalSampler(locale), **simulator_kwargs)
+    while True:
+        command, args = connection.recv()
+        if command == "act":
+            rewards = simulator.act(args)
+            connection.send((rewards, simulator.inTerminalState(), simulator.observe()))
+        elif command == "reset":
+            connection.send(simulator.reset(*args))
+        elif command == "get_state":
+            connection.send(simulator.get_state())
+        elif command == "close":
+            connection.close()
+            break
+
+
+class LocaleSimulatorPool(Simulator):
+    """
+        Vectorized simulator whose work orders are spread over one worker process per locale. Each worker runs a
+        VectorTransplanSimulator sampling response and work times from the logs of its locale. It provides the same
+        interface as VectorTransplanSimulator (reset(mode, mask), act(actions), observe(), inTerminalState()), so
+        NeuralAgent.runVectorized can drive it. Work order j belongs to locales[locale_ids[j]], which tags the
+        transitions of every step: transitionTags() gives them to NeuralAgent.runVectorized, which stores them
+        in the replay memory (DataSet.tags()) and in the test epochs given to summarizePerformance.
+
+        Parameters
+        ----------
+        locales: list of locales, one worker process each
+        envs_per_locale: number of work orders simulated by each worker
+        seed_sequences: one numpy.random.SeedSequence per locale, e.g. ExperimentSeeds.sequences("locale_pool", n).
+                        Fresh entropy is used if None.
+        simulator_kwargs: extra arguments given to every VectorTransplanSimulator
+    """
+    def __init__(self, locales=LOCALES, envs_per_locale=64, seed_sequences=None, **simulator_kwargs):
+        if seed_sequences is None:
+            seed_sequences = np.random.SeedSequence().spawn(len(locales))
+
+        self.locales = list(locales)
+        self.envs_per_locale = envs_per_locale
+        self.num_envs = envs_per_locale * len(locales)
+        self.locale_ids = np.repeat(np.arange(len(locales)), envs_per_locale)
+        self.action_space = ActionSpace(cost_range=simulator_kwargs.get("cost_range", list(range(1, 11))))
+
+        self._connections = []
+        self._processes = []
+        for locale, seed_sequence in zip(self.locales, seed_sequences):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=_worker, args=(child, locale, envs_per_locale, seed_sequence, simulator_kwargs), daemon=True)
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+        self._terminals = np.zeros(self.num_envs, dtype=bool)
+        self._observations = self.reset(-1)
+
+    def _split(self, values):
+        return np.split(np.asarray(values), len(self.locales))
+
+    def reset(self, mode, mask=None):
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        for connection, worker_mask in zip(self._connections, self._split(mask)):
+            connection.send(("reset", (mode, worker_mask)))
+        self._observations = np.concatenate([connection.recv() for connection in self._connections])
+        return self._observations.copy()
+
+    def act(self, actions):
+        """
+            Steps the work orders of all locales in parallel
+
+            Parameters:
+            -----------
+            actions : ndarray of int with size [num_envs]
+
+            Returns:
+            --------
+            rewards: ndarray of float with size [num_envs]
+        """
+        for connection, worker_actions in zip(self._connections, self._split(actions)):
+            connection.send(("act", worker_actions))
+        rewards, terminals, observations = zip(*[connection.recv() for connection in self._connections])
+        self._terminals = np.concatenate(terminals)
+        self._observations = np.concatenate(observations)
+        return np.concatenate(rewards)
+
+    def transitionTags(self):
+        """
+            Tag of the transitions of every step, for NeuralAgent.runVectorized: the locale id of each work order
+        """
+        return self.locale_ids.copy()
+
+    def get_state(self):
+        for connection in self._connections:
+            connection.send(("get_state", None))
+        return np.concatenate([connection.recv() for connection in self._connections])
+
+    def get_action_dimension(self):
+        return [(1,), (1,)]
+
+    def get_num_actions(self):
+        return self.action_space.n
+
+    def inTerminalState(self):
+        return self._terminals
+
+    def observe(self):
+        return self._observations.copy()
+
+    def summarizePerformance(self, test_data_set, *args, **kwargs):
+        rewards = test_data_set.rewards()
+        tags = test_data_set.tags()
+        print ("Test Episode summary")
+        for locale_id, locale in enumerate(self.locales):
+            locale_rewards = rewards[tags == locale_id]
+            print (locale, ": Transitions : ", len(locale_rewards), ", Mean Reward : ", np.mean(locale_rewards) if len(locale_rewards) else 0)
+        print ("==========================")
+
+    def end(self):
+        self.close()
+
+    def close(self):
+        for connection, process in zip(self._connections, self._processes):
+            if process.is_alive():
+                connection.send(("close", None))
+                process.join()
+            connection.close()
+        self._connections = []
+        self._processes = []
+
+
+if __name__ == "__main__":
+    pool = LocaleSimulatorPool(envs_per_locale=4)
+    rewards = pool.act(np.full(pool.num_envs, 33))
+    for locale_id, locale in enumerate(pool.locales):
+        print (locale, rewards[pool.locale_ids == locale_id].mean())
+    pool.close()
@@ -9,7 +9,10 @@ import os
 import numpy as np
 import copy
 import sys
+import json
 import joblib
+import queue
+import threading
 from warnings import warn
 # sys.path.insert(0, os.path.abspath("."))
 
@@ -29,11 +32,14 @@ class NeuralAgent(Agent):
                        replay_memory_size=1000000, 
                        replay_start_size=None, 
                        batch_size=32, 
-                       random_state=np.random.RandomState(), 
+                       random_state=np.random.default_rng(), 
                        exp_priority=0, 
                        train_policy=None, 
                        test_policy=None, 
-                       only_full_history=True):
+                       only_full_history=True,
+                       replay_dir=None,
+                       replay_storage=None,
+                       prefetch_batches=0):
 
         inputDims = environment.get_action_dimension()
         
@@ -51,11 +57,14 @@ class NeuralAgent(Agent):
         self._random_state = random_state
         self._exp_priority = exp_priority
         self._only_full_history = only_full_history
-        self._dataset = DataSet(environment, max_size=replay_memory_size, random_state=random_state, use_priority=self._exp_priority, only_full_history=self._only_full_history)
-        self._tmp_dataset = None # Will be created by startTesting() when necessary
+        self._dataset = DataSet(environment, max_size=replay_memory_size, random_state=random_state, use_priority=self._exp_priority, only_full_history=self._only_full_history, directory=replay_dir, storage=replay_storage)
+        self._tmp_dataset = None # Will be created by startMode() when necessary and reused afterwards
+        self._prefetch_batches = prefetch_batches   # Number of batches sampled in advance by a background thread (0: none)
+        self._prefetcher = None  # Will be created by the first train() when prefetch_batches > 0
         self._mode = -1
         self._mode_epochs_length = 0
         self._total_mode_reward = 0
+        self._totalModeNbrEpisode = 0
         self._training_loss_averages = []
         self._Vs_on_last_episode = []
         self._in_episode = False
@@ -149,8 +158,11 @@ class NeuralAgent(Agent):
             self._mode = mode
             self._mode_epochs_length = epochLength
             self._total_mode_reward = 0.
-            del self._tmp_dataset
-            self._tmp_dataset = DataSet(self._environment, self._random_state, max_size=self._replay_memory_size, only_full_history=self._only_full_history)
+            self._totalModeNbrEpisode = 0
+            if self._tmp_dataset is None:
+                self._tmp_dataset = EvaluationRecorder(self._environment, epochLength)
+            else:
+                self._tmp_dataset.clear(epochLength)
 
     def resumeTrainingMode(self):
         self._mode = -1
@@ -173,20 +185,62 @@ class NeuralAgent(Agent):
             return
 
         try:
+            kwargs = {}
             if hasattr(self._learning_algo, 'nstep'):
-                observations, actions, rewards, terminals, rndValidIndices = self._dataset.randomBatch_nstep(self._batch_size, self._learning_algo.nstep, self._exp_priority)
-                loss, loss_ind = self._learning_algo.train(observations, actions, rewards, terminals)
+                sample = self._randomBatch()
+                observations, actions, rewards, terminals, rndValidIndices = sample[:5]
+                batch = (observations, actions, rewards, terminals)
+                if getattr(self._learning_algo, 'nstep_returns', False):
+                    # Algorithms asking for it get the discounted n-step returns and bootstrap masks of the batch
+                    kwargs["returns"], kwargs["bootstrap"] = sample[5:]
             else:
-                states, actions, rewards, next_states, terminals, rndValidIndices = self._dataset.randomBatch(self._batch_size, self._exp_priority)
-                loss, loss_ind = self._learning_algo.train(states, actions, rewards, next_states, terminals)
+                states, actions, rewards, next_states, terminals, rndValidIndices = self._randomBatch()
+                batch = (states, actions, rewards, next_states, terminals)
+
+            if (self._exp_priority):
+                # The importance sampling weights of the prioritized batch are used as per-sample loss weights
+                kwargs["weights"] = rndValidIndices[2]
+            loss, loss_ind = self._learning_algo.train(*batch, **kwargs)
 
             self._training_loss_averages.append(loss)
             if (self._exp_priority):
-                self._dataset.updatePriorities(pow(loss_ind,self._exp_priority)+0.0001, rndValidIndices[1])
+                # Transitions overwritten since the batch was sampled (by a prefetcher) keep their new priorities
+                self._dataset.updatePriorities(pow(loss_ind,self._exp_priority)+0.0001, rndValidIndices[1], rndValidIndices[3])
 
         except SliceError as e:
             warn("Training not done - " + str(e), AgentWarning)
 
+    def _randomBatch(self):
+        """ Next training batch, from the prefetcher if prefetch_batches > 0, followed by its n-step returns and 
+        bootstrap masks if the learning algorithm asks for them
+        """
+        nstep = getattr(self._learning_algo, 'nstep', None)
+        discount = self._learning_algo.get_discount_factor if getattr(self._learning_algo, 'nstep_returns', False) else None
+        if (self._prefetch_batches > 0):
+            if (self._prefetcher is None):
+                self._prefetcher = BatchPrefetcher(self._dataset, self._batch_size, self._prefetch_batches, nstep, self._exp_priority, discount)
+            return self._prefetcher.get()
+        else:
+            return sampleBatch(self._dataset, self._batch_size, nstep, self._exp_priority, discount)
+
+    def stopPrefetching(self):
+        """ Stops the background thread sampling batches, if any (a new one is started by the next train())
+        """
+        if (self._prefetcher is not None):
+            self._prefetcher.close()
+            self._prefetcher = None
+
+    def saveReplayMemory(self):
+        """ Saves the replay memory in the directory given as replay_dir (does nothing if it is None), so that a 
+        NeuralAgent created with the same replay_dir resumes from it.
+        """
+        self._dataset.flush()
+
+    def setImportanceSamplingExponent(self, beta):
+        """ Set the exponent beta of the importance sampling weights of prioritized replay
+        """
+        self._dataset.setImportanceSamplingExponent(beta)
+
     def dumpNetwork(self, fname, nEpoch=-1):
         """ Dump the network
         
@@ -267,6 +321,8 @@ class NeuralAgent(Agent):
             for c in self._controllers: c.onEpochEnd(self)
             
         self._environment.end()
+        self.stopPrefetching()
+        self.saveReplayMemory()
         for c in self._controllers: c.onEnd(self)
 
     def _runEpisode(self, maxSteps):
@@ -321,7 +377,90 @@ class NeuralAgent(Agent):
         for c in self._controllers: c.onEpisodeEnd(self, is_terminal, reward)
         return maxSteps
 
-        
+    def runVectorized(self, vector_environment, n_steps):
+        """
+        This function runs n_steps steps on a vectorized simulator (such as VectorTransplanSimulator) that
+        advances num_envs independent episodes per call and resets the finished ones by itself.
+        Transitions are stored in the replay memory (or in the test dataset when not in training mode) one
+        whole episode at a time, so that consecutive samples of the dataset still belong to the same episode.
+        Episodes still running after the last step are truncated, not terminated: their last transition is stored 
+        as non terminal, followed by the observation it leads to (DataSet.endTrajectory) to bootstrap from.
+        If vector_environment provides transitionTags() (e.g. the locale ids of LocaleSimulatorPool), the transitions
+        are stored with the tag of their work order.
+        Controllers get onActionChosen once per environment, in the order of the environments. In test mode, the 
+        episodes ended (terminated or truncated) are counted for totalRewardOverLastTest, and avgEpisodeVValue 
+        averages the mean V of the environments at every step of the call.
+
+        Parameters
+        -----------
+        vector_environment : vectorized simulator
+            It provides reset(mode, mask), act(actions) -> rewards, observe() -> [num_envs, number of inputs]
+            and inTerminalState() -> terminal mask of the last step
+        n_steps : int
+            number of calls to vector_environment.act()
+
+        Returns
+        -------
+        Number of episodes that reached a terminal state
+        """
+        num_envs = vector_environment.num_envs
+        inputDims = vector_environment.get_action_dimension()
+        states = [np.zeros((num_envs,) + inputDims[i], dtype=float) for i in range(len(inputDims))]
+        episodes = [[] for _ in range(num_envs)]
+        n_terminals = 0
+        if hasattr(vector_environment, "transitionTags"):
+            tags = vector_environment.transitionTags()
+        else:
+            tags = np.full(num_envs, -1)
+
+        self._in_episode = True
+        self._Vs_on_last_episode = []
+        vector_environment.reset(self._mode)
+        for step in range(n_steps):
+            obs = vector_environment.observe()
+            for i in range(len(inputDims)):
+                states[i][:, 0:-1] = states[i][:, 1:]
+                states[i][:, -1] = obs[:, i]
+
+            if self._mode != -1:
+                actions, V = self._test_policy.batch_action(states, mode=self._mode, dataset=self._dataset)
+            elif self._dataset.n_elems > self._replay_start_size:
+                actions, V = self._train_policy.batch_action(states, mode=None, dataset=self._dataset)
+            else:
+                actions, V = self._train_policy.batch_random_action(num_envs)
+            self._Vs_on_last_episode.append(np.mean(V))
+            for j in range(num_envs):
+                for c in self._controllers: c.onActionChosen(self, actions[j])
+
+            rewards = vector_environment.act(actions)
+            terminals = vector_environment.inTerminalState()
+            last_step = step == n_steps - 1
+            if self._mode != -1:
+                self._total_mode_reward += rewards.sum()
+                self._totalModeNbrEpisode += num_envs if last_step else np.count_nonzero(terminals)
+
+            for j in range(num_envs):
+                episodes[j].append((obs[j], actions[j], rewards[j], terminals[j], tags[j]))
+
+            for c in self._controllers: c.onActionTaken(self)
+
+            if last_step:
+                next_obs = vector_environment.observe()
+            for j in np.flatnonzero(terminals | last_step):
+                for sample in episodes[j]:
+                    self._addSample(*sample)
+                if not terminals[j]:
+                    self._endTrajectory(next_obs[j], tags[j])
+                episodes[j] = []
+                for i in range(len(inputDims)):
+                    states[i][j] = 0
+                for c in self._controllers: c.onEpisodeEnd(self, terminals[j], rewards[j])
+            n_terminals += np.count_nonzero(terminals)
+
+        self._in_episode = False
+        return n_terminals
+
+
     def _step(self):
         """
         This method is called at each time step and performs one action in the environment.
@@ -343,11 +482,17 @@ class NeuralAgent(Agent):
 
         return V, action, reward
 
-    def _addSample(self, ponctualObs, action, reward, is_terminal):
+    def _addSample(self, ponctualObs, action, reward, is_terminal, tag=-1):
+        if self._mode != -1:
+            self._tmp_dataset.addSample(ponctualObs, action, reward, is_terminal, priority=1, tag=tag)
+        else:
+            self._dataset.addSample(ponctualObs, action, reward, is_terminal, priority=1, tag=tag)
+
+    def _endTrajectory(self, ponctualObs, tag=-1):
         if self._mode != -1:
-            self._tmp_dataset.addSample(ponctualObs, action, reward, is_terminal, priority=1)
+            self._tmp_dataset.endTrajectory(ponctualObs, tag=tag)
         else:
-            self._dataset.addSample(ponctualObs, action, reward, is_terminal, priority=1)
+            self._dataset.endTrajectory(ponctualObs, tag=tag)
 
 
     def _chooseAction(self):
@@ -385,10 +530,19 @@ class AgentWarning(RuntimeWarning):
         msg  -- explanation of the error
     """
 
+# Storage types of the replay memory fields. None for observations means env.observationType(i).
+DEFAULT_STORAGE = {"observations": None, "actions": "int8", "rewards": "float32", "terminals": "bool", "tags": "int8"}
+COMPACT_STORAGE = {"observations": "float16", "actions": "uint8", "rewards": "float16", "terminals": "packed", "tags": "int8"}
+# Number of slots allocated at first by the in-memory buffers, doubled as they fill up
+INITIAL_BUFFER_SIZE = 4096
+# Steps since terminal recorded for the observation closing a truncated trajectory (DataSet.endTrajectory), 
+# which is not a transition. The other counts are saturated right below it.
+END_OF_TRAJECTORY = 65535
+
 class DataSet(object):
     """A replay memory consisting of circular buffers for observations, actions, rewards and terminals."""
 
-    def __init__(self, env, random_state=None, max_size=1000000, use_priority=False, only_full_history=True):
+    def __init__(self, env, random_state=None, max_size=1000000, use_priority=False, only_full_history=True, directory=None, storage=None):
         """Initializer.
         Parameters
         -----------
@@ -396,10 +550,17 @@ class DataSet(object):
             Each tuple relates to one of the observations where the first value is the history size considered for this
             observation and the rest describes the shape of each punctual observation (e.g., scalar, vector or matrix). 
             See base_classes.Environment.inputDimensions() documentation for more info.
-        random_state : Numpy random number generator
-            If None, a new one is created with default numpy seed.
+        random_state : numpy.random.Generator
+            If None, a new one is created with fresh entropy.
         max_size : float
             The replay memory maximum size. Default : 1000000
+        directory : str
+            If not None, the buffers are memory-mapped .npy files of this directory and flush() saves the cursors in
+            its header file. A directory holding a replay memory of the same shapes is resumed. Default : None
+        storage : dict
+            Storage type of some of the fields "observations", "actions", "rewards", "terminals" and "tags", the 
+            others being taken from DEFAULT_STORAGE. COMPACT_STORAGE uses float16 observations and rewards, uint8 actions 
+            and terminals packed 8 per byte ("packed"). Default : None
         """
 
         self._batch_dimensions = env.get_action_dimension()
@@ -407,28 +568,122 @@ class DataSet(object):
         self._size = max_size
         self._use_priority = use_priority
         self._only_full_history = only_full_history
+        self._directory = directory
+        if (directory is not None):
+            os.makedirs(directory, exist_ok=True)
+        self._storage = dict(DEFAULT_STORAGE)
+        self._storage.update(storage or {})
         if ( isinstance(env.get_num_actions(),int) ):
-            self._actions      = CircularBuffer(max_size, dtype="int8")
+            if (np.iinfo(self._storage["actions"]).max < env.get_num_actions() - 1):
+                raise AgentError("The actions storage " + self._storage["actions"] + " cannot hold " + str(env.get_num_actions()) + " actions.")
+            self._actions      = CircularBuffer(max_size, dtype=self._storage["actions"], path=self._path("actions"), initial_size=INITIAL_BUFFER_SIZE)
         else:
-            self._actions      = CircularBuffer(max_size, dtype='object')
-        self._rewards      = CircularBuffer(max_size)
-        self._terminals    = CircularBuffer(max_size, dtype="bool")
+            self._actions      = CircularBuffer(max_size, dtype='object', path=self._path("actions"), initial_size=INITIAL_BUFFER_SIZE)
+        self._rewards      = CircularBuffer(max_size, dtype=self._storage["rewards"], path=self._path("rewards"), initial_size=INITIAL_BUFFER_SIZE)
+        if (self._storage["terminals"] == "packed"):
+            self._terminals    = BitCircularBuffer(max_size, path=self._path("terminals"), initial_size=INITIAL_BUFFER_SIZE)
+        else:
+            self._terminals    = CircularBuffer(max_size, dtype="bool", path=self._path("terminals"), initial_size=INITIAL_BUFFER_SIZE)
+        # Source of each transition given to addSample, e.g. the locale id of LocaleSimulatorPool (-1: untagged)
+        self._tags         = CircularBuffer(max_size, dtype=self._storage["tags"], path=self._path("tags"), initial_size=INITIAL_BUFFER_SIZE)
+        # Number of consecutive non terminal transitions right before each transition (saturated at 65534, far more 
+        # than any history length), END_OF_TRAJECTORY for the observations closing truncated trajectories
+        self._since_terminal = CircularBuffer(max_size, dtype="uint16", path=self._path("since_terminal"), initial_size=INITIAL_BUFFER_SIZE)
+        # Absolute indices of the valid timesteps for each minimum_without_terminal requested so far
+        self._valid_indices = {}
+        self._last_terminal = False
+        self._last_since_terminal = 0
         if (self._use_priority):
             self._prioritiy_tree = tree.SumTree(max_size) 
-            self._translation_array = np.zeros(max_size)
+            self._min_priority_tree = tree.MinTree(max_size)
+            # Leaf i of the trees holds the priority of the transition stored in slot i of the buffers, see 
+            # CircularBuffer.getSlots and CircularBuffer.getIndices to go from one to the other.
+            # Priority of each leaf of the tree, to rebuild it when the replay memory is resumed
+            self._priorities = openArray(self._path("priorities"), (max_size,), 'float64')
 
         self._observations = np.zeros(len(self._batch_dimensions), dtype='object')
         # Initialize the observations container if necessary
         for i in range(len(self._batch_dimensions)):
-            self._observations[i] = CircularBuffer(max_size, elemShape=self._batch_dimensions[i][1:], dtype=env.observationType(i))
+            dtype = self._storage["observations"] or env.observationType(i)
+            self._observations[i] = CircularBuffer(max_size, elemShape=self._batch_dimensions[i][1:], dtype=dtype, path=self._path("observations_{}".format(i)), initial_size=INITIAL_BUFFER_SIZE)
 
         if (random_state == None):
-            self._random_state = np.random.RandomState()
+            self._random_state = np.random.default_rng()
         else:
             self._random_state = random_state
 
         self.n_elems  = 0
         self.sticky_action=1        # Number of times the agent is forced to take the same action as part of one actual time step
+        self._importance_exponent = 0.  # Exponent beta of the importance sampling weights of prioritized replay
+        # Serializes the writes (addSample, updatePriorities) with the batches sampled by a BatchPrefetcher thread
+        self.lock = threading.RLock()
+
+        if (directory is not None and os.path.exists(self._path("header", ".json"))):
+            self._loadHeader()
+
+    def _path(self, name, extension=".npy"):
+        if (self._directory is None):
+            return None
+        return os.path.join(self._directory, name + extension)
+
+    def _buffers(self):
+        buffers = {"actions": self._actions, "rewards": self._rewards, "terminals": self._terminals, "tags": self._tags, "since_terminal": self._since_terminal}
+        for i in range(len(self._observations)):
+            buffers["observations_{}".format(i)] = self._observations[i]
+        return buffers
+
+    def memory_report(self):
+        """Returns the number of bytes currently allocated by each field of the replay memory, and their "total".
+        """
+        report = {}
+        for name, buffer in self._buffers().items():
+            report[name] = buffer.nbytes()
+        if (self._use_priority):
+            report["priorities"] = self._prioritiy_tree._tree.nbytes + self._min_priority_tree._tree.nbytes + self._priorities.nbytes
+        report["valid_indices"] = sum(valid_indices._data.nbytes for valid_indices in self._valid_indices.values())
+        if (hasattr(self, "_returns_cache")):
+            report["nstep_returns"] = self._returns_cache.nbytes + self._bootstrap_cache.nbytes + self._returns_stamps.nbytes
+        report["total"] = sum(report.values())
+        return report
+
+    def flush(self):
+        """Writes the memory-mapped buffers to disk, then the header holding the cursors of the replay memory. Does 
+        nothing if the replay memory is not backed by a directory.
+        """
+        if (self._directory is None):
+            return
+        header = {"max_size": self._size,
+                  "n_elems": self.n_elems,
+                  "last_terminal": bool(self._last_terminal),
+                  "last_since_terminal": int(self._last_since_terminal),
+                  "buffers": {}}
+        for name, buffer in self._buffers().items():
+            buffer.flush()
+            header["buffers"][name] = buffer.getCursor()
+        if (self._use_priority):
+            self._priorities.flush()
+            header["max_priority"] = self._prioritiy_tree._max_priority
+        # Write then rename so that a crash never leaves a truncated header
+        with open(self._path("header", ".json.tmp"), "w") as f:
+            json.dump(header, f, indent=2)
+        os.replace(self._path("header", ".json.tmp"), self._path("header", ".json"))
+
+    def _loadHeader(self):
+        with open(self._path("header", ".json")) as f:
+            header = json.load(f)
+        if (header["max_size"] != self._size):
+            raise AgentError("The replay memory of " + self._directory + " has max_size " + str(header["max_size"]) + ", not " + str(self._size) + ".")
+        self.n_elems = header["n_elems"]
+        self._last_terminal = header["last_terminal"]
+        self._last_since_terminal = header["last_since_terminal"]
+        for name, buffer in self._buffers().items():
+            buffer.setCursor(header["buffers"][name])
+        if (self._use_priority and "max_priority" in header):
+            n_leaves = min(self._actions.getIndex(), self._size)
+            self._prioritiy_tree.updateBatch(np.arange(n_leaves), self._priorities[:n_leaves])
+            # Observations closing truncated trajectories have a zero priority and no bearing on the minimum
+            self._min_priority_tree.updateBatch(np.arange(n_leaves), np.where(self._priorities[:n_leaves] > 0, self._priorities[:n_leaves], np.inf))
+            self._prioritiy_tree._max_priority = header["max_priority"]
 
     def actions(self):
         """Get all actions currently in the replay memory, ordered by time where they were taken."""
@@ -449,6 +704,14 @@ class DataSet(object):
 
         return self._terminals.getSlice(0)
 
+    def tags(self, indices=None):
+        """Get the tags of all transitions currently in the replay memory, ordered by time, or of the transitions of 
+        indices (e.g. rndValidIndices of randomBatch) to check the mix of sources a batch is made of.
+        """
+        if (indices is None):
+            return self._tags.getSlice(0)
+        return self._tags.getSliceBySeq(indices)
+
     def observations(self):
         """Get all observations currently in the replay memory, ordered by time where they were observed.
         """
@@ -459,11 +722,21 @@ class DataSet(object):
 
         return ret
 
-    def updatePriorities(self, priorities, rndValidIndices):
-        """
+    def updatePriorities(self, priorities, rndValidIndices, absolute_indices=None):
+        """Sets the priorities of a whole batch of tree leaves (as returned by randomBatch) at once.
+
+        With absolute_indices, the absolute indices of the transitions when the batch was sampled (also returned by 
+        randomBatch), the priorities of the transitions overwritten since then (e.g. while the batch was waiting in a 
+        BatchPrefetcher) are not updated, as their leaves now hold other transitions.
         """
-        for i in range( len(rndValidIndices) ):
-            self._prioritiy_tree.update(rndValidIndices[i], priorities[i])
+        with self.lock:
+            if (absolute_indices is not None):
+                current = np.asarray(absolute_indices) >= self._firstAbsoluteIndex()
+                priorities = np.asarray(priorities)[current]
+                rndValidIndices = np.asarray(rndValidIndices)[current]
+            self._prioritiy_tree.updateBatch(rndValidIndices, priorities)
+            self._min_priority_tree.updateBatch(rndValidIndices, priorities)
+            self._priorities[rndValidIndices] = priorities
 
     def randomBatch(self, batch_size, use_priority):
         """Returns a batch of states, actions, rewards, terminal status, and next_states for a number batch_size of randomly
@@ -493,6 +766,10 @@ class DataSet(object):
             with size [batch_size * history size * size of punctual observation (which is 2D,1D or scalar)]).
         terminals : numpy array of booleans [batch_size] 
             terminals[i] is True if the transition leads to a terminal state and False otherwise
+        rndValidIndices : numpy array of integers [batch_size]
+            Indices of the transitions in the replay memory. With prioritized replay, list of these indices, of the 
+            leaves of the priority tree (for updatePriorities), of the importance sampling weights of the transitions 
+            and of their absolute indices (for updatePriorities, to detect the transitions overwritten since).
 
         Throws
         -------
@@ -513,56 +790,40 @@ class DataSet(object):
             if (rndValidIndices.size == 0):
                 raise SliceError("Could not find a state with full histories")
         else:
-            rndValidIndices = np.zeros(batch_size, dtype='int32')
             if (self._only_full_history):
-                for i in range(batch_size): # TODO: multithread this loop?
-                    rndValidIndices[i] = self._randomValidStateIndex(self._max_history_size+self.sticky_action-1)
+                rndValidIndices = self._randomValidStateIndices(batch_size, self._max_history_size+self.sticky_action-1)
             else:
-                for i in range(batch_size): # TODO: multithread this loop?
-                    rndValidIndices[i] = self._randomValidStateIndex(minimum_without_terminal=self.sticky_action)
+                rndValidIndices = self._randomValidStateIndices(batch_size, minimum_without_terminal=self.sticky_action)
                 
 
         actions   = self._actions.getSliceBySeq(rndValidIndices)
         rewards   = self._rewards.getSliceBySeq(rndValidIndices)
         terminals = self._terminals.getSliceBySeq(rndValidIndices)
-    
-        states = np.zeros(len(self._batch_dimensions), dtype='object')
-        next_states = np.zeros_like(states)
+
         # We calculate the first terminal index backward in time and set it 
         # at maximum to the value self._max_history_size+self.sticky_action-1
-        first_terminals=[]
-        for rndValidIndex in rndValidIndices:
-            first_terminal=1
-            while first_terminal<self._max_history_size+self.sticky_action-1:
-                if (self._terminals[rndValidIndex-first_terminal]==True or first_terminal>rndValidIndex):
-                    break 
-                first_terminal+=1
-            first_terminals.append(first_terminal)
-            
+        first_terminals = self._firstTerminals(rndValidIndices, self._max_history_size+self.sticky_action-1)
+        # Number of punctual observations of the state (resp. next state) that belong to the same trajectory
+        state_lengths = first_terminals + 2*self.sticky_action - 2
+        next_state_lengths = first_terminals + 1
+        # If transition leads to terminal, we don't care about next state
+        next_state_valid = np.logical_not((rndValidIndices >= self.n_elems - 1) | terminals)
+
+        states = np.zeros(len(self._batch_dimensions), dtype='object')
+        next_states = np.zeros_like(states)
         for input in range(len(self._batch_dimensions)):
-            states[input] = np.zeros((batch_size,) + self._batch_dimensions[input], dtype=self._observations[input].dtype)
-            next_states[input] = np.zeros_like(states[input])
-            for i in range(batch_size):
-                slice=self._observations[input].getSlice(rndValidIndices[i]-self.sticky_action+2-min(self._batch_dimensions[input][0],first_terminals[i]+self.sticky_action-1), rndValidIndices[i]+1)
-                if (len(slice)==len(states[input][i])):
-                    states[input][i] = slice
-                else:
-                    for j in range(len(slice)):
-                        states[input][i][-j-1]=slice[-j-1]
-                 # If transition leads to terminal, we don't care about next state
-                if rndValidIndices[i] >= self.n_elems - 1 or terminals[i]:
-                    next_states[input][i] = np.zeros_like(states[input][i])
-                else:
-                    slice=self._observations[input].getSlice(rndValidIndices[i]+2-min(self._batch_dimensions[input][0],first_terminals[i]+1), rndValidIndices[i]+2)
-                    if (len(slice)==len(states[input][i])):
-                        next_states[input][i] = slice
-                    else:
-                        for j in range(len(slice)):
-                            next_states[input][i][-j-1]=slice[-j-1]
-                    #next_states[input][i] = self._observations[input].getSlice(rndValidIndices[i]+2-min(self._batch_dimensions[input][0],first_terminal), rndValidIndices[i]+2)
-        
+            history_size = self._batch_dimensions[input][0]
+            # Histories are right aligned, the older observations outside the trajectory are zero padded
+            position = np.arange(history_size - 1, -1, -1)
+            states[input] = self._observations[input].getWindows(rndValidIndices + 1, history_size)
+            next_states[input] = self._observations[input].getWindows(rndValidIndices + 2, history_size)
+            state_mask = position[None, :] < np.minimum(state_lengths, history_size)[:, None]
+            next_state_mask = (position[None, :] < np.minimum(next_state_lengths, history_size)[:, None]) & next_state_valid[:, None]
+            states[input][~state_mask] = 0
+            next_states[input][~next_state_mask] = 0
+
         if (self._use_priority):
-            return states, actions, rewards, next_states, terminals, [rndValidIndices, rndValidIndices_tree]
+            return states, actions, rewards, next_states, terminals, [rndValidIndices, rndValidIndices_tree, self.importanceWeights(rndValidIndices_tree), rndValidIndices + self._firstAbsoluteIndex()]
         else:
             return states, actions, rewards, next_states, terminals, rndValidIndices
 
@@ -616,99 +877,167 @@ class DataSet(object):
             if (rndValidIndices.size == 0):
                 raise SliceError("Could not find a state with full histories")
         else:
-            rndValidIndices = np.zeros(batch_size, dtype='int32')
             if (self._only_full_history):
-                for i in range(batch_size): # TODO: multithread this loop?
-                    rndValidIndices[i] = self._randomValidStateIndex(self._max_history_size+self.sticky_action*nstep-1)
+                rndValidIndices = self._randomValidStateIndices(batch_size, self._max_history_size+self.sticky_action*nstep-1)
             else:
-                for i in range(batch_size): # TODO: multithread this loop?
-                    rndValidIndices[i] = self._randomValidStateIndex(minimum_without_terminal=self.sticky_action*nstep)
+                rndValidIndices = self._randomValidStateIndices(batch_size, minimum_without_terminal=self.sticky_action*nstep)
                 
 
-        actions=np.zeros((batch_size,(nstep)*self.sticky_action), dtype=int)
-        rewards=np.zeros((batch_size,(nstep)*self.sticky_action))
-        terminals=np.zeros((batch_size,(nstep)*self.sticky_action))
-        for i in range(batch_size):
-            actions[i] = self._actions.getSlice(rndValidIndices[i]-self.sticky_action*nstep+1,rndValidIndices[i]+self.sticky_action)
-            rewards[i] = self._rewards.getSlice(rndValidIndices[i]-self.sticky_action*nstep+1,rndValidIndices[i]+self.sticky_action)
-            terminals[i] = self._terminals.getSlice(rndValidIndices[i]-self.sticky_action*nstep+1,rndValidIndices[i]+self.sticky_action)
-        
-        observations = np.zeros(len(self._batch_dimensions), dtype='object')
+        # Windows of the nstep transitions ending at rndValidIndices
+        window_end = rndValidIndices + self.sticky_action
+        window_length = self.sticky_action*(nstep+1) - 1
+        actions = self._actions.getWindows(window_end, window_length).astype(int)
+        rewards = self._rewards.getWindows(window_end, window_length).astype(float)
+        terminals = self._terminals.getWindows(window_end, window_length).astype(float)
+
         # We calculate the first terminal index backward in time and set it 
-        # at maximum to the value self._max_history_size+self.sticky_action-1
-        first_terminals=[]
-        for rndValidIndex in rndValidIndices:
-            first_terminal=1
-            while first_terminal<self._max_history_size+self.sticky_action*nstep-1:
-                if (self._terminals[rndValidIndex-first_terminal]==True or first_terminal>rndValidIndex):
-                    break 
-                first_terminal+=1
-            first_terminals.append(first_terminal)
-            
-        batch_dimensions=copy.deepcopy(self._batch_dimensions)
+        # at maximum to the value self._max_history_size+self.sticky_action*nstep-1
+        first_terminals = self._firstTerminals(rndValidIndices, self._max_history_size+self.sticky_action*nstep-1)
+
+        observations = np.zeros(len(self._batch_dimensions), dtype='object')
         for input in range(len(self._batch_dimensions)):
-            batch_dimensions[input]=tuple( x + y for x, y in zip(self._batch_dimensions[input],(self.sticky_action*(nstep+1)-1,0,0)) )
-            observations[input] = np.zeros((batch_size,) + batch_dimensions[input], dtype=self._observations[input].dtype)
-            for i in range(batch_size):
-                slice=self._observations[input].getSlice(rndValidIndices[i]-self.sticky_action*nstep+2-min(self._batch_dimensions[input][0],first_terminals[i]-self.sticky_action*nstep+1), rndValidIndices[i]+self.sticky_action+1)
-                if (len(slice)==len(observations[input][i])):
-                    observations[input][i] = slice
-                else:
-                    for j in range(len(slice)):
-                        observations[input][i][-j-1]=slice[-j-1]
-                 # If transition leads to terminal, we don't care about next state
-                if terminals[i][-1]:#rndValidIndices[i] >= self.n_elems - 1 or terminals[i]:
-                    observations[input][rndValidIndices[i]:rndValidIndices[i]+self.sticky_action+1] = 0
-        
+            history_size = self._batch_dimensions[input][0]
+            length = history_size + window_length
+            # Histories are right aligned, the older observations outside the trajectory are zero padded
+            position = np.arange(length - 1, -1, -1)
+            observations[input] = self._observations[input].getWindows(rndValidIndices + self.sticky_action + 1, length)
+            lengths = window_length + np.clip(first_terminals - self.sticky_action*nstep + 1, 0, history_size)
+            observations[input][~(position[None, :] < lengths[:, None])] = 0
+            # If transition leads to terminal, we don't care about the observations that follow it
+            observations[input][terminals[:, -1] > 0, length - self.sticky_action:] = 0
+
         if (self._use_priority):
-            return observations, actions, rewards, terminals, [rndValidIndices, rndValidIndices_tree]
+            return observations, actions, rewards, terminals, [rndValidIndices, rndValidIndices_tree, self.importanceWeights(rndValidIndices_tree), rndValidIndices + self._firstAbsoluteIndex()]
         else:
             return observations, actions, rewards, terminals, rndValidIndices
 
 
-    def _randomValidStateIndex(self, minimum_without_terminal):
-        """ Returns the index corresponding to a timestep that is valid
+    def nstepReturns(self, indices, nstep, discount, use_cache=True):
+        """Discounted returns of the nstep transitions ending at indices (as sampled by randomBatch_nstep), 
+        truncated at the first terminal transition, and whether they should be bootstrapped with the value of the 
+        state that follows them (False if they contain a terminal transition).
+
+        With use_cache, the returns are kept per transition and computed once until nstep or discount change.
+        
+        Returns
+        -------
+        returns : numpy array of floats [len(indices)]
+        bootstrap : numpy array of booleans [len(indices)]
+        """
+        indices = np.asarray(indices)
+        if (not use_cache):
+            with self.lock:
+                return self._nstepReturns(indices, nstep, discount)
+
+        with self.lock:
+            return self._cachedNstepReturns(indices, nstep, discount)
+
+    def _cachedNstepReturns(self, indices, nstep, discount):
+
+        if (getattr(self, "_returns_parameters", None) != (nstep, discount)):
+            self._returns_parameters = (nstep, discount)
+            self._returns_cache = np.zeros(self._size)
+            self._bootstrap_cache = np.zeros(self._size, dtype='bool')
+            # Absolute index + 1 of the transition whose return is held by each slot (0 if none)
+            self._returns_stamps = np.zeros(self._size, dtype='int64')
+
+        slots = self._rewards.getSlots(indices)
+        stamps = self._rewards.getLowerBound() + indices + 1
+        missing = self._returns_stamps[slots] != stamps
+        if (np.any(missing)):
+            returns, bootstrap = self._nstepReturns(indices[missing], nstep, discount)
+            self._returns_cache[slots[missing]] = returns
+            self._bootstrap_cache[slots[missing]] = bootstrap
+            self._returns_stamps[slots[missing]] = stamps[missing]
+
+        return self._returns_cache[slots], self._bootstrap_cache[slots]
+
+    def _nstepReturns(self, indices, nstep, discount):
+        window_length = self.sticky_action*nstep
+        rewards = self._rewards.getWindows(indices + 1, window_length).astype(float)
+        not_terminals = np.logical_not(self._terminals.getWindows(indices + 1, window_length))
+        # alive[:, j] is False once a transition before j was terminal
+        alive = np.ones_like(rewards, dtype='bool')
+        alive[:, 1:] = np.logical_and.accumulate(not_terminals[:, :-1], axis=1)
+        returns = np.sum(rewards * alive * discount ** np.arange(window_length), axis=1)
+        bootstrap = np.logical_and(alive[:, -1], not_terminals[:, -1])
+        return returns, bootstrap
+
+    def _firstTerminals(self, indices, max_distance):
+        """ For each index, distance k >= 1 to the closest terminal transition at index-k (or to the beginning of the 
+        replay memory), capped to max_distance.
+        """
+        first_terminals = np.full(len(indices), max_distance)
+        if (max_distance > 1):
+            # terminals[i, k-1] is the terminal status of the transition indices[i]-k
+            terminals = self._terminals.getWindows(indices, max_distance - 1)[:, ::-1]
+            distances = np.arange(1, max_distance)
+            hits = terminals | (distances[None, :] > indices[:, None])
+            first_terminals = np.where(hits.any(axis=1), np.argmax(hits, axis=1) + 1, first_terminals)
+        return first_terminals
+
+    def _validIndexSet(self, minimum_without_terminal):
+        """ Returns the ValidIndexSet of minimum_without_terminal, built from the steps since terminal of the 
+        transitions in the replay memory the first time it is requested and then kept up to date by addSample.
         """
-        index_lowerBound = minimum_without_terminal - 1
-        # We try out an index in the acceptable range of the replay memory
-        index = self._random_state.randint(index_lowerBound, self.n_elems-1) 
+        if (minimum_without_terminal not in self._valid_indices):
+            since_terminal = self._since_terminal.getSlice(0)
+            first = self._firstAbsoluteIndex()
+            indices = np.flatnonzero((since_terminal >= minimum_without_terminal - 1) & (since_terminal != END_OF_TRAJECTORY))
+            indices = indices[indices >= minimum_without_terminal - 1] + first
+            self._valid_indices[minimum_without_terminal] = ValidIndexSet(minimum_without_terminal, indices)
+        return self._valid_indices[minimum_without_terminal]
+
+    def _randomValidStateIndices(self, n, minimum_without_terminal):
+        """ Returns n indices drawn uniformly among the timesteps that are valid, i.e. preceded by at least 
+        minimum_without_terminal-1 transitions of the same trajectory. The last transition is never drawn.
+        """
+        valid_indices = self._validIndexSet(minimum_without_terminal).indices()
+        first = self._firstAbsoluteIndex()
+        n_valid = np.searchsorted(valid_indices, first + self.n_elems - 1)
+        if (n_valid == 0):
+            raise SliceError("Could not find a state with full histories")
 
-        # Check if slice is valid wrt terminals
-        # The selected index may correspond to a terminal transition but not 
-        # the previous minimum_without_terminal-1 transition
-        firstTry = index
-        startWrapped = False
-        while True:
-            i = index-1
-            processed = 0
-            for _ in range(minimum_without_terminal-1):
-                if (i < 0 or self._terminals[i]):
-                    break;
-
-                i -= 1
-                processed += 1
-            if (processed < minimum_without_terminal - 1):
-                # if we stopped prematurely, shift slice to the left and try again
-                index = i
-                if (index < index_lowerBound):
-                    startWrapped = True
-                    index = self.n_elems - 1
-                if (startWrapped and index <= firstTry):
-                    raise SliceError("Could not find a state with full histories")
-            else:
-                # else index was ok according to terminals
-                return index
+        return (valid_indices[self._random_state.integers(0, n_valid, n)] - first).astype('int32')
+
+    def _nearestValidStateIndices(self, indices, minimum_without_terminal):
+        """ Returns, for each index, the closest valid timestep at or before it, or the last valid timestep of the 
+        replay memory if there is none before it. All the returned indices are -1 if there is no valid timestep at all.
+        """
+        valid_indices = self._validIndexSet(minimum_without_terminal).indices()
+        first = self._firstAbsoluteIndex()
+        valid_indices = valid_indices[:np.searchsorted(valid_indices, first + self.n_elems - 1, side='right')]
+        if (len(valid_indices) == 0):
+            return np.full(np.shape(indices), -1)
+        positions = np.searchsorted(valid_indices, first + np.asarray(indices), side='right') - 1
+        return valid_indices[positions] - first
+
+    def _firstAbsoluteIndex(self):
+        """ Absolute index (number of transitions added before it) of the transition at index 0 """
+        return self._terminals.getLowerBound()
     
+    def setImportanceSamplingExponent(self, beta):
+        """Sets the exponent beta of the importance sampling weights returned with prioritized batches. 0 (default)
+        gives uniform weights, 1 fully compensates the non-uniform sampling.
+        """
+        self._importance_exponent = beta
+
+    def importanceWeights(self, indices_tree, beta=None):
+        """Importance sampling weights (N * P(i)) ** -beta of the transitions held by the leaves indices_tree, 
+        normalized by the largest possible weight (the one of the lowest priority) so that they are at most 1.
+        """
+        if (beta is None):
+            beta = self._importance_exponent
+        priorities = self._prioritiy_tree.getPriority(indices_tree)
+        return np.power(priorities / self._min_priority_tree.min(), -beta).astype('float32')
+
     def _randomPrioritizedBatch(self, batch_size):
         indices_tree = self._prioritiy_tree.getBatch(batch_size, self._random_state, self)
-        indices_replay_mem=np.zeros(indices_tree.size,dtype='int32')
-        for i in range(len(indices_tree)):
-            indices_replay_mem[i]= int(self._translation_array[indices_tree[i]] \
-                         - self._actions.getLowerBound())
+        indices_replay_mem = self._actions.getIndices(indices_tree).astype('int32')
         
         return indices_replay_mem, indices_tree
 
-    def addSample(self, obs, action, reward, is_terminal, priority):
+    def addSample(self, obs, action, reward, is_terminal, priority, tag=-1):
         """Store the punctual observations, action, reward, is_terminal and priority in the dataset. 
         Parameters
         -----------
@@ -723,92 +1052,453 @@ class DataSet(object):
             Tells whether [action] lead to a terminal state (i.e. corresponded to a terminal transition).
         priority : float
             The priority to be associated with the sample
+        tag : int
+            Source of the transition, e.g. the locale id of LocaleSimulatorPool (-1: untagged)
         """        
+        with self.lock:
+            self._addSample(obs, action, reward, is_terminal, priority, tag)
+
+    def endTrajectory(self, obs, tag=-1):
+        """Closes the trajectory of the last sample without it being terminal, e.g. an episode cut by a step limit. 
+        obs is the punctual observation that follows it, stored so that the last transition is bootstrapped from its 
+        actual next state. It is not a transition itself and is never drawn (and has a zero priority). Returns of 
+        randomBatch_nstep windows and nstepReturns are not bootstrapped past it.
+        """
+        with self.lock:
+            self._addSample(obs, 0, 0, True, 0, tag, is_transition=False)
+
+    def _addSample(self, obs, action, reward, is_terminal, priority, tag=-1, is_transition=True):
         # Store observations
         for i in range(len(self._batch_dimensions)):
             self._observations[i].append(obs[i])
 
-        # Update tree and translation table
+        # Update tree with the leaf of the slot where the transition is stored (the one of the transition that is 
+        # overwritten once the replay memory is full)
         if (self._use_priority):
-            index = self._actions.getIndex()
-            if (index >= self._size):
-                ub = self._actions.getUpperBound()
-                true_size = self._actions.getTrueSize()
-                tree_ind = index%self._size
-                if (ub == true_size):
-                    size_extension = true_size - self._size
-                    # New index
-                    index = self._size - 1
-                    tree_ind = -1
-                    # Shift translation array
-                    self._translation_array -= size_extension + 1
-                tree_ind = np.where(self._translation_array==tree_ind)[0][0]
+            tree_ind = self._actions.getIndex() % self._size
+            if (is_transition):
+                self._priorities[tree_ind] = self._prioritiy_tree.update(tree_ind)
+                self._min_priority_tree.update(tree_ind, self._priorities[tree_ind])
             else:
-                tree_ind = index
-
-            self._prioritiy_tree.update(tree_ind)
-            self._translation_array[tree_ind] = index
+                self._priorities[tree_ind] = self._prioritiy_tree.update(tree_ind, 0)
+                self._min_priority_tree.update(tree_ind, np.inf)
 
         # Store rest of sample
+        if (self.n_elems == 0 or self._last_terminal):
+            since_terminal = 0
+        else:
+            since_terminal = self._last_since_terminal + 1
+        self._last_terminal = is_terminal
+        self._last_since_terminal = since_terminal
         self._actions.append(action)
         self._rewards.append(reward)
         self._terminals.append(is_terminal)
+        self._tags.append(tag)
+        self._since_terminal.append(min(since_terminal, END_OF_TRAJECTORY - 1) if is_transition else END_OF_TRAJECTORY)
 
         if (self.n_elems < self._size):
             self.n_elems += 1
 
+        # Update the valid timesteps (absolute indices) with the new transition and the evicted ones
+        first = self._firstAbsoluteIndex()
+        for minimum_without_terminal, valid_indices in self._valid_indices.items():
+            if (is_transition and since_terminal >= minimum_without_terminal - 1):
+                valid_indices.append(self._terminals.getIndex() - 1)
+            valid_indices.discardBefore(first + minimum_without_terminal - 1)
+
         
+class ValidIndexSet(object):
+    """ Increasing absolute indices of the transitions preceded by at least minimum_without_terminal-1 transitions 
+    of the same trajectory. Indices are appended at the end as transitions are added and discarded from the start as 
+    they leave the replay memory.
+    """
+    def __init__(self, minimum_without_terminal, indices=()):
+        self.minimum_without_terminal = minimum_without_terminal
+        self._data = np.zeros(max(1024, 2*len(indices)), dtype='int64')
+        self._data[:len(indices)] = indices
+        self._start = 0
+        self._end = len(indices)
+
+    def append(self, index):
+        if (self._end == len(self._data)):
+            n = self._end - self._start
+            if (n > len(self._data) // 2):
+                data = np.zeros(2*len(self._data), dtype='int64')
+            else:
+                data = self._data
+            data[:n] = self._data[self._start:self._end]
+            self._data = data
+            self._start = 0
+            self._end = n
+        self._data[self._end] = index
+        self._end += 1
+
+    def discardBefore(self, index):
+        while (self._start < self._end and self._data[self._start] < index):
+            self._start += 1
+
+    def indices(self):
+        return self._data[self._start:self._end]
+
+    def __len__(self):
+        return self._end - self._start
+
+
+class BatchPrefetcher(object):
+    """Samples the next batches of a DataSet in a background thread while the current one is used for training.
+
+    Batches are copied into n_batches + 1 preallocated buffers: up to n_batches are ready in advance and the last one
+    returned by get() stays valid until the next call to get(). Sampling holds dataset.lock, which addSample and
+    updatePriorities also take, so a batch never sees a half-written transition. Priority updates are applied 
+    synchronously, in the order they are made, and are taken into account by the batches sampled after them. 
+    Transitions may be overwritten while their batch waits: prioritized batches carry the absolute indices of their 
+    transitions so that updatePriorities drops the updates of those, and n-step returns are computed with the batch.
+    A SliceError met in advance may be outdated by the samples added since: get() samples again before raising it.
+    """
+
+    def __init__(self, dataset, batch_size, n_batches=2, nstep=None, use_priority=False, discount=None):
+        """Initializer.
+        Parameters
+        -----------
+        dataset : DataSet
+        batch_size : int
+        n_batches : int
+            Number of batches sampled in advance
+        nstep : int
+            If not None, batches are sampled with dataset.randomBatch_nstep for this nstep
+        use_priority : Boolean
+            Whether to use prioritized replay or not
+        discount : callable
+            If not None, n-step batches are followed by their n-step returns and bootstrap masks for the discount 
+            factor it returns (see sampleBatch)
+        """
+        self._dataset = dataset
+        self._batch_size = batch_size
+        self._nstep = nstep
+        self._use_priority = use_priority
+        self._discount = discount
+        self._buffers = [None] * (n_batches + 1)
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for slot in range(n_batches + 1):
+            self._free.put(slot)
+        self._current = None
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        return sampleBatch(self._dataset, self._batch_size, self._nstep, self._use_priority, self._discount)
+
+    def _run(self):
+        while True:
+            slot = self._free.get()
+            if (self._stopped):
+                return
+            try:
+                batch = self._sample()
+            except SliceError as e:
+                self._ready.put((slot, e))
+                continue
+            if (self._buffers[slot] is None):
+                self._buffers[slot] = _allocateLike(batch)
+            _copyInto(batch, self._buffers[slot])
+            self._ready.put((slot, None))
+
+    def get(self):
+        """Returns the next batch, as returned by sampleBatch, and releases the buffer of the previous one. Raises 
+        SliceError if the batch could not be sampled in advance and still cannot be sampled now.
+        """
+        if (self._current is not None):
+            self._free.put(self._current)
+            self._current = None
+        slot, error = self._ready.get()
+        if (error is not None):
+            self._free.put(slot)
+            return self._sample()
+        self._current = slot
+        return self._buffers[slot]
+
+    def close(self):
+        self._stopped = True
+        self._free.put(None)
+        self._thread.join()
+
+
+def sampleBatch(dataset, batch_size, nstep=None, use_priority=False, discount=None):
+    """Samples a batch with dataset.randomBatch, or dataset.randomBatch_nstep if nstep is not None, holding dataset.lock.
+    With discount (a callable returning the discount factor), an n-step batch is followed by its returns and bootstrap
+    masks (dataset.nstepReturns), computed before any other sample is added.
+    """
+    with dataset.lock:
+        if (nstep is None):
+            return dataset.randomBatch(batch_size, use_priority)
+        batch = dataset.randomBatch_nstep(batch_size, nstep, use_priority)
+        if (discount is not None):
+            indices = batch[4][0] if use_priority else batch[4]
+            batch = batch + dataset.nstepReturns(indices, nstep, discount())
+        return batch
+
+def _allocateLike(batch):
+    if isinstance(batch, (list, tuple)):
+        return type(batch)(_allocateLike(x) for x in batch)
+    if (batch.dtype == object):
+        ret = np.zeros_like(batch)
+        for i in range(len(batch)):
+            ret[i] = _allocateLike(batch[i])
+        return ret
+    return np.empty_like(batch)
+
+def _copyInto(batch, buffer):
+    if isinstance(batch, (list, tuple)) or batch.dtype == object:
+        for x, y in zip(batch, buffer):
+            _copyInto(x, y)
+    else:
+        np.copyto(buffer, batch)
+
+
+class EvaluationRecorder(object):
+    """Records the transitions of a test or validation epoch for summarizePerformance. Unlike DataSet, its arrays are 
+    sized to the epoch length and are reused (cleared) from one test epoch to the next.
+    """
+
+    def __init__(self, env, size):
+        """Initializer.
+        Parameters
+        -----------
+        env : Environment
+            The environment, providing the observation shapes and types and the number of actions.
+        size : int
+            Expected number of transitions per epoch. The arrays grow if more transitions are recorded.
+        """
+        self._batch_dimensions = env.get_action_dimension()
+        if ( isinstance(env.get_num_actions(),int) ):
+            self._actions = np.zeros(size, dtype="int32")
+        else:
+            self._actions = np.zeros(size, dtype="object")
+        self._rewards = np.zeros(size, dtype="float32")
+        self._terminals = np.zeros(size, dtype="bool")
+        self._tags = np.zeros(size, dtype="int8")
+        self._observations = np.zeros(len(self._batch_dimensions), dtype='object')
+        for i in range(len(self._batch_dimensions)):
+            self._observations[i] = np.zeros((size,) + self._batch_dimensions[i][1:], dtype=env.observationType(i))
+        self.n_elems = 0
+
+    def clear(self, size=0):
+        """Forgets the recorded transitions, making room for at least size of them."""
+        if (size > len(self._rewards)):
+            self._resize(size)
+        self.n_elems = 0
+
+    def _resize(self, size):
+        self._actions = self._grow(self._actions, size)
+        self._rewards = self._grow(self._rewards, size)
+        self._terminals = self._grow(self._terminals, size)
+        self._tags = self._grow(self._tags, size)
+        for i in range(len(self._observations)):
+            self._observations[i] = self._grow(self._observations[i], size)
+
+    def _grow(self, array, size):
+        grown = np.zeros((size,) + array.shape[1:], dtype=array.dtype)
+        grown[:self.n_elems] = array[:self.n_elems]
+        return grown
+
+    def actions(self):
+        return self._actions[:self.n_elems]
+
+    def rewards(self):
+        return self._rewards[:self.n_elems]
+
+    def terminals(self):
+        return self._terminals[:self.n_elems]
+
+    def tags(self):
+        return self._tags[:self.n_elems]
+
+    def observations(self):
+        ret = np.zeros_like(self._observations)
+        for input in range(len(self._observations)):
+            ret[input] = self._observations[input][:self.n_elems]
+
+        return ret
+
+    def addSample(self, obs, action, reward, is_terminal, priority=1, tag=-1):
+        """Same as DataSet.addSample, the priority is ignored."""
+        if (self.n_elems == len(self._rewards)):
+            self._resize(max(2 * self.n_elems, 1))
+        for i in range(len(self._observations)):
+            self._observations[i][self.n_elems] = obs[i]
+        self._actions[self.n_elems] = action
+        self._rewards[self.n_elems] = reward
+        self._terminals[self.n_elems] = is_terminal
+        self._tags[self.n_elems] = tag
+        self.n_elems += 1
+
+    def endTrajectory(self, obs, tag=-1):
+        """Same as DataSet.endTrajectory. Only transitions are recorded, the observation is ignored."""
+        pass
+
+
 class CircularBuffer(object):
-    def __init__(self, size, elemShape=(), extension=0.1, dtype="float32"):
+    """Ring buffer of the last size appended elements. Element i (0 is the oldest one) is stored in slot 
+    (start + i) % size and indices handed to the DataSet are relative to the oldest element. The absolute index of an 
+    element is the number of elements appended before it.
+    """
+    def __init__(self, size, elemShape=(), dtype="float32", path=None, initial_size=None):
         self._size = size
-        self._data = np.zeros((int(size+extension*size),) + elemShape, dtype=dtype)
-        self._trueSize = self._data.shape[0]
-        self._lb   = 0
-        self._ub   = size
-        self._cur  = 0
+        self._elemShape = elemShape
         self.dtype = dtype
-    
+        # In-memory buffers start with initial_size slots and double until size, memory-mapped ones are allocated
+        # at once (their file is sparse until written)
+        if path is None and initial_size is not None:
+            self._data = self._allocate(None, min(size, initial_size))
+        else:
+            self._data = self._allocate(path, size)
+        self._start = 0
+        self._n    = 0
+        self._cur  = 0
+
+    def _allocate(self, path, capacity):
+        return openArray(path, (capacity,) + self._elemShape, self.dtype)
+
+    def _capacity(self):
+        return len(self._data)
+
+    def _grow(self):
+        # Slots are only added before the buffer wraps around, i.e. while the elements are in slots [0, n)
+        data = self._allocate(None, min(self._size, 2 * self._capacity()))
+        data[:len(self._data)] = self._data
+        self._data = data
+
+    def _read(self, slots):
+        return self._data[slots]
+
+    def _write(self, slot, obj):
+        self._data[slot] = obj
+
     def append(self, obj):
-        if self._cur > self._size:  #> instead of >=
-            self._lb += 1
-            self._ub += 1
-
-        if self._ub >= self._trueSize:
-            # Rolling array without copying whole array (for memory constraints)
-            # basic command: self._data[0:self._size-1] = self._data[self._lb:] OR NEW self._data[0:self._size] = self._data[self._lb-1:]
-            n_splits=10
-            for i in range(n_splits):
-                self._data[i*(self._size)//n_splits:(i+1)*(self._size)//n_splits] = self._data[(self._lb-1)+i*(self._size)//n_splits:(self._lb-1)+(i+1)*(self._size)//n_splits]
-            self._lb  = 0
-            self._ub  = self._size
-            self._cur = self._size #OLD self._size - 1
-
-        self._data[self._cur] = obj
+        slot = (self._start + self._n) % self._size
+        if slot >= self._capacity():
+            self._grow()
+        self._write(slot, obj)
+        if self._n < self._size:
+            self._n += 1
+        else:
+            self._start = (self._start + 1) % self._size
         self._cur += 1
 
     def __getitem__(self, i):
-        return self._data[self._lb + i]
+        return self._read((self._start + i) % self._size)
 
     def getSliceBySeq(self, seq):
-        return self._data[seq + self._lb]
+        return self._read((np.asarray(seq) + self._start) % self._size)
+
+    def getWindows(self, ends, length):
+        """ Returns the elements [ends[i]-length, ends[i]) for each i with one fancy indexing, with size 
+        [len(ends) * length * elemShape]. Positions outside of the buffer are clipped to its first (resp. last) element.
+        """
+        positions = np.asarray(ends)[:, None] + np.arange(-length, 0)[None, :]
+        positions = np.clip(positions, 0, max(self._n - 1, 0))
+        return self._read((positions + self._start) % self._size)
+
+    def getSlots(self, indices):
+        """ Slots of the data array holding the elements of the given indices """
+        return (self._start + np.asarray(indices)) % self._size
+
+    def getIndices(self, slots):
+        """ Indices of the elements held by the given slots of the data array """
+        return (np.asarray(slots) - self._start) % self._size
+
+    def getSegments(self, start, end=sys.maxsize):
+        """ Returns the elements [start, end) as a list of one or two views of the buffer (two when they wrap 
+        around its end).
+        """
+        start = min(max(start, 0), self._n)
+        end = min(max(end, start), self._n)
+        first = (self._start + start) % self._size
+        last = first + end - start
+        if last <= self._size:
+            return [self._data[first:last]]
+        return [self._data[first:], self._data[:last - self._size]]
 
     def getSlice(self, start, end=sys.maxsize):
-        if end == sys.maxsize:
-            return self._data[self._lb+start:self._cur]
-        else:
-            return self._data[self._lb+start:self._lb+end]
+        segments = self.getSegments(start, end)
+        if len(segments) == 1:
+            return segments[0]
+        return np.concatenate(segments)
 
     def getLowerBound(self):
-        return self._lb
+        """ Absolute index of the oldest element """
+        return self._cur - self._n
 
     def getUpperBound(self):
-        return self._ub
+        return self.getLowerBound() + self._size
 
     def getIndex(self):
+        """ Absolute index of the next element to be appended """
         return self._cur
 
     def getTrueSize(self):
-        return self._trueSize
+        return self._size
+
+    def getCursor(self):
+        return {"start": self._start, "n": self._n, "cur": self._cur}
+
+    def setCursor(self, cursor):
+        self._start = cursor["start"]
+        self._n = cursor["n"]
+        self._cur = cursor["cur"]
+
+    def flush(self):
+        if isinstance(self._data, np.memmap):
+            self._data.flush()
+
+    def nbytes(self):
+        return self._data.nbytes
+
+
+class BitCircularBuffer(CircularBuffer):
+    """CircularBuffer of booleans packed 8 per byte (e.g. terminals)."""
+    def __init__(self, size, path=None, initial_size=None):
+        CircularBuffer.__init__(self, size, (), "bool", path, initial_size)
+
+    def _allocate(self, path, capacity):
+        return openArray(path, ((capacity + 7) // 8,), "uint8")
+
+    def _capacity(self):
+        return 8 * len(self._data)
+
+    def _read(self, slots):
+        slots = np.asarray(slots)
+        return ((self._data[slots >> 3] >> (slots & 7)) & 1).astype(bool)
+
+    def _write(self, slot, obj):
+        bit = 1 << (slot & 7)
+        if obj:
+            self._data[slot >> 3] |= bit
+        else:
+            self._data[slot >> 3] &= 0xFF ^ bit
+
+    def getSegments(self, start, end=sys.maxsize):
+        start = min(max(start, 0), self._n)
+        end = min(max(end, start), self._n)
+        return [self._read(self.getSlots(np.arange(start, end)))]
+
+
+def openArray(path, shape, dtype):
+    """ Returns a zero-filled array if path is None, else a memory-mapped .npy file, created if it does not exist and
+    opened read-write otherwise (its shape and dtype must then match).
+    """
+    if path is None:
+        return np.zeros(shape, dtype=dtype)
+    if np.dtype(dtype).hasobject:
+        raise AgentError("Arrays of objects cannot be memory-mapped (" + path + ").")
+    if not os.path.exists(path):
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+    data = np.lib.format.open_memmap(path, mode="r+")
+    if data.shape != tuple(shape) or data.dtype != np.dtype(dtype):
+        raise AgentError("The file " + path + " holds an array " + str(data.dtype) + str(data.shape) + " instead of " + str(np.dtype(dtype)) + str(tuple(shape)) + ".")
+    return data
 
 
 class SliceError(LookupError):
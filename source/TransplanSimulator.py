@@ -1,9 +1,38 @@
 import numpy as np
-import pandas as pd
 import math 
 
 from interface import Simulator, ActionSpace
-from helper.helpers import synthesize, parse_action
+from helper.helpers import reward_and_time, reward_and_time_pandas, check_reward_and_time
+from helper.samplers import ParametricSampler
+from helper.instrumentation import StepRecorder, LOG_OFF, LOG_PRINT
+from helper.analytic import expected_inverse_floored_gaussian, expected_work_time_penalty, total_time_cdf, quantile_from_cdf
+
+
+# Episode state of a simulator, as a record of a structured array. Arrays of it hold branched states (see fork).
+STATE_DTYPE = np.dtype([("num_translation_string", np.int64),
+                        ("num_candidates", np.int64),
+                        ("sla", np.float64),
+                        ("budget", np.float64),
+                        ("cumulative_success_rate", np.float64),
+                        ("episode_counter", np.int64),
+                        ("last_action", np.int64)])
+
+class TransplanState(object):
+    """
+        Compact snapshot of the episode state of a TransplanSimulator, see get_state() / set_state().
+        The random generator and the fixed configuration of the simulator are not part of it.
+    """
+    __slots__ = STATE_DTYPE.names
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def to_record(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return "TransplanState({})".format(", ".join("{}={}".format(name, getattr(self, name)) for name in self.__slots__))
 
 
 # In the simplied version, two actions are in the space: [vote, collection]
@@ -17,7 +46,11 @@ class TransplanSimulator(Simulator):
                        sla = 3600 * 2, # 2 hours in seconds
                        budget = 100 * 7, # 7 dollars in cents
                        tolerance_rate = 1e-3,
-                       cost_range = list(range(1, 11))):
+                       cost_range = list(range(1, 11)),
+                       engine = "numpy",
+                       sampler = None,
+                       log_level = LOG_OFF,
+                       log_path = None):
         
         # Set up parameters of MTurk
         self.origin_num_translation_string = num_translation_string # The number of vote job on one translation issue
@@ -36,6 +69,19 @@ class TransplanSimulator(Simulator):
         self.cumulative_success_rate = 0
         self.random_state = rng
 
+        # Engine computing the reward and the time of one step: "numpy" (default), "pandas" (reference) or
+        # "expectation" (expected reward and time without sampling, for fast pretraining)
+        if engine == "numpy":
+            self._reward_and_time = reward_and_time
+        elif engine == "pandas":
+            self._reward_and_time = reward_and_time_pandas
+        elif engine == "expectation":
+            self._reward_and_time = None
+            self._expectation_cache = {}
+        else:
+            raise Exception('The engine ' + engine + ' is not implemented.')
+        self.engine = engine
+
         # Define the observation of Simulator
         # At each time step, the observation is [cumulative success rate, action]
         self.last_punctual_observation = [0, 0]
@@ -51,7 +97,20 @@ class TransplanSimulator(Simulator):
         self.work_time_upper_bound = self.work_time_lower_bound * 10 # Assume 10 times lower bound = upper bound
         self.min_response_time = 74 # seconds
 
+        # Sampler of response time and work time, e.g. helper.samplers.EmpiricalSampler for the MTurk logs
+        if sampler is None:
+            sampler = ParametricSampler(std=self.std, shape=self.shape)
+        self.sampler = sampler
+        if engine == "expectation" and not isinstance(sampler, ParametricSampler):
+            raise Exception('The expectation engine requires a ParametricSampler.')
+
         self.episode_counter = 0
+        self.num_episodes = 0
+
+        # Per-step instrumentation, see helper.instrumentation. Nothing is recorded with LOG_OFF.
+        self.log_level = log_level
+        self.recorder = StepRecorder(path=log_path)
+
         """
             Constituency: Same/Different = [0.8, 1] 
             Candidates: Eliminate least voted / Same candidate / Additional Candidate = [1, 0.8, 1.2] 
@@ -62,6 +121,12 @@ class TransplanSimulator(Simulator):
         self.candidates_rate_vector = [1, 0.8, 1.2]
         self.voting_rate_vector = [0.8, 1] 
 
+        # Lookup tables of the 120 actions: components, success rate, cost in cents and validity
+        self.action_space = ActionSpace(rate_vectors=[("constituency", self.constituency_rate_vector),
+                                                      ("candidate", self.candidates_rate_vector),
+                                                      ("voting", self.voting_rate_vector)],
+                                        cost_range=cost_range)
+
     def reset(self, mode):
         if mode == -1:
             self.num_translation_string = self.origin_num_translation_string 
@@ -73,6 +138,7 @@ class TransplanSimulator(Simulator):
         self.num_candidates = 3
         self.cumulative_success_rate = 0
         self.episode_counter = 0
+        self.num_episodes += 1
 
         return [1*[0], 0]
 
@@ -96,33 +162,37 @@ class TransplanSimulator(Simulator):
             
         """
 
-        constituency, candidate, voting, cost = parse_action(action)
+        constituency, candidate, voting, cost = self.action_space.decode(action).tolist()
 
         # Update num of candidate
+        # The success rate and the validity of the step are looked up for the action actually performed
+        performed_action = action
         if candidate == 0:
             if self.num_candidates <= 0:
                 candidate = 1
+                performed_action = self.action_space.replace(action, "candidate", 1)
             else:
                 self.num_candidates -= 1
 
         if candidate == 2:
             self.num_candidates += 1 
 
-        response_time_sample = synthesize(dist="Gaussian", 
-                                          sample_size=self.num_translation_string,
-                                          parameters={"mean": 1 / self.cost_range[cost], "std": self.std},
-                                          random_generator=self.random_state)
+        cost_cents = self.action_space.cost[action]
+        if self.engine != "expectation":
+            response_time_sample = self.sampler.response_time(self.num_translation_string, 
+                                                              cost_cents, 
+                                                              self.random_state)
         
-        # For different constituency, response time increase 20%
-        if constituency == 1:
-            response_time_sample = response_time_sample * 1.2
+            # For different constituency, response time increase 20%
+            if constituency == 1:
+                response_time_sample = response_time_sample * 1.2
         
 
-        # For work time, lower bound is set at 3 seconds * num_candidates
-        work_time_sample = synthesize(dist="Pareto",
-                                      sample_size=self.num_translation_string,
-                                      parameters={"shape": self.shape, "scale": self.work_time_lower_bound},
-                                      random_generator=self.random_state)
+            # For work time, lower bound is set at 3 seconds * num_candidates
+            work_time_sample = self.sampler.work_time(self.num_translation_string, 
+                                                      cost_cents, 
+                                                      self.work_time_lower_bound, 
+                                                      self.random_state)
         
         success_rate = 0
         if self.episode_counter == 0:
@@ -130,37 +200,27 @@ class TransplanSimulator(Simulator):
         else:
             # Same constituency + Same candidate => success rate = 0
             # Assign a large negative number as a punishment
-            if constituency == 1 and candidate == 1:
+            if not self.action_space.valid[performed_action]:
+                if self.log_level:
+                    self._log_step(0, -9999, 0, 0)
                 return -9999
             else:
-                success_rate = self.constituency_rate_vector[constituency] * \
-                               self.candidates_rate_vector[candidate] * \
-                               self.voting_rate_vector[voting]
-        
-        print ("success_rate : ", success_rate)
-
-        df = pd.DataFrame(data={"response_time": response_time_sample, "work_time": work_time_sample})
-
-        # import pdb; pdb.set_trace();
-        
-        min_response_time = self.min_response_time
-        work_time_lower_bound = self.work_time_lower_bound
-        work_time_upper_bound = self.work_time_upper_bound
+                success_rate = self.action_space.success_rate[performed_action]
 
         # Cumulative Rewards - Quadratic function makes the rewards mostly likely negative 
-        df['reward'] = df.apply(lambda row: success_rate * 
-                                            ((1 / max(row['response_time'], min_response_time)) - 
-                                            (row['work_time'] - work_time_lower_bound) * 
-                                            (row['work_time'] - work_time_upper_bound)), axis=1)
-        
-        # Average out reward to number of translations
-        reward = df['reward'].sum() / self.num_translation_string
-        
-        df['total_time'] = df.apply(lambda row: row['response_time'] + row['work_time'], axis=1)
+        # Reward is averaged out to number of translations, time spent is the longest total time
+        if self.engine == "expectation":
+            reward, time = self._expected_reward_and_time(success_rate, cost_cents, constituency)
+        else:
+            reward, time = self._reward_and_time(response_time_sample, 
+                                                 work_time_sample, 
+                                                 success_rate, 
+                                                 self.min_response_time, 
+                                                 self.work_time_lower_bound, 
+                                                 self.work_time_upper_bound)
 
-        # Calculate time and money spent
-        time = df['total_time'].max()
-        money = self.cost_range[cost] * self.num_translation_string
+        # Calculate money spent
+        money = cost_cents * self.num_translation_string
 
         # In case of additional translation
         if candidate == 2:
@@ -176,8 +236,9 @@ class TransplanSimulator(Simulator):
         
         # Increase cumulative success rate
         self.cumulative_success_rate += (1 - self.cumulative_success_rate) * success_rate
-        print ("Cumulative Success Rate : ", self.cumulative_success_rate)
-        print ("In terminated state : ", self.inTerminalState())
+
+        if self.log_level:
+            self._log_step(success_rate, reward, time, money)
 
         # Update episode_counter
         self.episode_counter += 1
@@ -188,11 +249,55 @@ class TransplanSimulator(Simulator):
 
         return reward
 
+    def _expected_reward_and_time(self, success_rate, cost_cents, constituency):
+        """
+            Expected reward of one step and quantile n / (n + 1) of the total time of one string, which 
+            approximates the expected longest total time over the n strings of the work order.
+            The moments and the total time CDF only depend on the cost and the constituency (the work time 
+            bounds are fixed), they are computed once per pair and cached.
+        """
+        key = (cost_cents, constituency)
+        if key not in self._expectation_cache:
+            # For different constituency, response time increase 20%
+            scale = 1.2 if constituency == 1 else 1
+            mean = scale / cost_cents
+            std = scale * self.sampler.std
+            cap = self.work_time_lower_bound * 20
+            expected_reward = expected_inverse_floored_gaussian(mean, std, self.min_response_time) - \
+                              expected_work_time_penalty(self.sampler.shape, 
+                                                         self.work_time_lower_bound, 
+                                                         cap, 
+                                                         self.work_time_lower_bound, 
+                                                         self.work_time_upper_bound)
+            t, cdf = total_time_cdf(mean, std, self.sampler.shape, self.work_time_lower_bound, cap)
+            self._expectation_cache[key] = (expected_reward, t, cdf)
+
+        expected_reward, t, cdf = self._expectation_cache[key]
+        n = self.num_translation_string
+        return success_rate * expected_reward, quantile_from_cdf(t, cdf, n / (n + 1))
+
+    def _log_step(self, success_rate, reward, time, money):
+        terminal = self.inTerminalState()
+        self.recorder.record(self.num_episodes, self.episode_counter, success_rate, reward, time, money, terminal)
+        if self.log_level >= LOG_PRINT:
+            print ("success_rate : ", success_rate)
+            print ("Cumulative Success Rate : ", self.cumulative_success_rate)
+            print ("In terminated state : ", terminal)
+
+    def set_log_level(self, level):
+        self.log_level = level
+
+    def flush_log(self, path=None):
+        """
+            Write the recorded steps to path (the log_path given to the constructor by default)
+        """
+        return self.recorder.flush(path)
+
     def get_action_dimension(self):
         return [(1,), (1,)]
 
     def get_num_actions(self):
-        return 120
+        return self.action_space.n
 
     def inTerminalState(self):
         isTerminated = (1 - self.cumulative_success_rate) <= self.tolerance_rate or \
@@ -210,23 +315,62 @@ class TransplanSimulator(Simulator):
     def get_episode_counter(self):
         return self.episode_counter
 
+    def get_state(self):
+        """
+            Returns a TransplanState snapshot of the current episode
+        """
+        return TransplanState(self.num_translation_string, 
+                              self.num_candidates, 
+                              self.sla, 
+                              self.budget, 
+                              self.cumulative_success_rate, 
+                              self.episode_counter, 
+                              self.last_punctual_observation[1])
+
+    def set_state(self, state):
+        """
+            Restores a snapshot given by get_state(), or one record of an array of STATE_DTYPE
+        """
+        if isinstance(state, np.void):
+            state = TransplanState(*state.tolist())
+        self.num_translation_string = state.num_translation_string
+        self.num_candidates = state.num_candidates
+        self.sla = state.sla
+        self.budget = state.budget
+        self.cumulative_success_rate = state.cumulative_success_rate
+        self.episode_counter = state.episode_counter
+        self.last_punctual_observation[0] = state.cumulative_success_rate
+        self.last_punctual_observation[1] = state.last_action
+
+    def fork(self, n):
+        """
+            Returns n copies of the current episode state as an array of STATE_DTYPE, to be loaded in a 
+            VectorTransplanSimulator with set_state() to roll out n branches from this point.
+        """
+        states = np.empty(n, dtype=STATE_DTYPE)
+        states[:] = self.get_state().to_record()
+        return states
+
     def summarizePerformance(self, test_data_set, *args, **kwargs):
-        print ("Test Episode action sequence")
-        print ("Observations : ", test_data_set.observations())
-        print ("Actions : ", test_data_set.actions())
-        print ("Rewards : ", test_data_set.rewards())
-        print ("Terminals : ", test_data_set.terminals())
+        rewards = test_data_set.rewards()
+        terminals = test_data_set.terminals()
+        print ("Test Episode summary")
+        print ("Transitions : ", len(rewards), ", Terminals : ", np.count_nonzero(terminals))
+        print ("Total Reward : ", np.sum(rewards), ", Mean Reward : ", np.mean(rewards) if len(rewards) else 0)
+        actions, counts = np.unique(test_data_set.actions(), return_counts=True)
+        print ("Action counts : ", dict(zip(actions.tolist(), counts.tolist())))
         print ("Contraints : ", self.get_constraints())
         print ("Current Observation : ", self.observe())
         print ("Episode Counter : ", self.get_episode_counter())
         print ("==========================")
-
+        self.flush_log()
 
 if __name__ == "__main__":
-    rng = np.random.RandomState(1)
-    mySimulator = TransplanSimulator(rng)
+    rng = np.random.default_rng(1)
+    mySimulator = TransplanSimulator(rng, log_level=LOG_PRINT)
 
     print (mySimulator.act(110))
     print (mySimulator.get_constraints())
     print (mySimulator.observe())
+    print ("Max relative difference between engines : ", check_reward_and_time(random_generator=rng))
     
\ No newline at end of file
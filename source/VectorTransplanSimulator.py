@@ -0,0 +1,242 @@
+import numpy as np
+
+from interface import Simulator, ActionSpace
+from helper.samplers import ParametricSampler
+from TransplanSimulator import STATE_DTYPE
+
+
+# Batched version of TransplanSimulator: N independent work orders are advanced by one call to act().
+# Episode state is kept as length-N arrays and finished episodes are reset automatically.
+
+class VectorTransplanSimulator(Simulator):
+    def __init__(self, rng,
+                       num_envs=64,
+                       num_translation_string=100,
+                       init_num_candidates=3,
+                       min_majority = 5,
+                       sla = 3600 * 2, # 2 hours in seconds
+                       budget = 100 * 7, # 7 dollars in cents
+                       tolerance_rate = 1e-3,
+                       cost_range = list(range(1, 11)),
+                       sampler = None):
+
+        self.num_envs = num_envs
+        self.origin_num_translation_string = num_translation_string
+        self.init_num_candidates = init_num_candidates
+        self.min_majority = min_majority
+        self.num_worker = min_majority + (min_majority - 1) * (init_num_candidates - 1)
+
+        self.origin_sla = sla
+        self.origin_budget = budget
+        self.tolerance_rate = tolerance_rate
+        self.cost_range = cost_range
+        self.random_state = rng
+
+        # Episode state of every work order
+        self.num_translation_string = np.zeros(num_envs, dtype=np.int64)
+        self.num_candidates = np.zeros(num_envs, dtype=np.int64)
+        self.sla = np.zeros(num_envs)
+        self.budget = np.zeros(num_envs)
+        self.cumulative_success_rate = np.zeros(num_envs)
+        self.episode_counter = np.zeros(num_envs, dtype=np.int64)
+
+        # At each time step, the observation of one work order is [cumulative success rate, action]
+        self.last_punctual_observation = np.zeros((num_envs, 2))
+        self._terminals = np.zeros(num_envs, dtype=bool)
+        self._mode = -1
+
+        # Fixed configurations from MTurk experiment, same as TransplanSimulator
+        self.std = 117
+        self.shape = 0.825
+        self.translation_time = 3600
+        self.translation_cost = 0.05 * self.num_worker
+        self.work_time_lower_bound = 3 * init_num_candidates
+        self.work_time_upper_bound = self.work_time_lower_bound * 10
+        self.min_response_time = 74
+
+        if sampler is None:
+            sampler = ParametricSampler(std=self.std, shape=self.shape)
+        self.sampler = sampler
+
+        self.constituency_rate_vector = [0.8, 1]
+        self.candidates_rate_vector = [1, 0.8, 1.2]
+        self.voting_rate_vector = [0.8, 1]
+
+        self.action_space = ActionSpace(rate_vectors=[("constituency", self.constituency_rate_vector),
+                                                      ("candidate", self.candidates_rate_vector),
+                                                      ("voting", self.voting_rate_vector)],
+                                        cost_range=cost_range)
+
+        self.reset(self._mode)
+
+    def reset(self, mode, mask=None):
+        """
+            Reset the work orders selected by mask (all of them if mask is None) and return the observations
+        """
+        self._mode = mode
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+
+        if mode == -1:
+            self.num_translation_string[mask] = self.origin_num_translation_string
+        else:
+            self.num_translation_string[mask] = 100
+
+        self.sla[mask] = self.origin_sla
+        self.budget[mask] = self.origin_budget
+        self.num_candidates[mask] = self.init_num_candidates
+        self.cumulative_success_rate[mask] = 0
+        self.episode_counter[mask] = 0
+        self.last_punctual_observation[mask] = 0
+
+        return self.observe()
+
+    def act(self, actions):
+        """
+            Perform one time-step within every environment. Environments reaching a terminal state
+            are reset right after the step; the terminal mask of the step is given by inTerminalState().
+
+            Parameters:
+            -----------
+            actions : ndarray of int with size [num_envs]
+
+            Returns:
+            --------
+            rewards: ndarray of float with size [num_envs]
+        """
+        actions = np.asarray(actions)
+        constituency, candidate, voting, cost = self.action_space.decode(actions).T
+
+        # Update num of candidates, success rate and validity are looked up for the actions actually performed
+        eliminate = candidate == 0
+        no_candidate = eliminate & (self.num_candidates <= 0)
+        performed_actions = np.where(no_candidate, self.action_space.replace(actions, "candidate", 1), actions)
+        candidate = np.where(no_candidate, 1, candidate)
+        self.num_candidates -= eliminate & ~no_candidate
+        self.num_candidates += candidate == 2
+
+        # Draw the samples of all work orders at once, one per remaining string: work order j owns the segment 
+        # starts[j]:starts[j] + num_strings[j] of the flat draw
+        num_strings = self.num_translation_string
+        counts = np.maximum(num_strings, 0)
+        starts = np.cumsum(counts) - counts
+        nonempty = counts > 0
+
+        cost_cents = self.action_space.cost[actions]
+        sample_cost = np.repeat(cost_cents, counts)
+        response_time = self.sampler.response_time(len(sample_cost), sample_cost, self.random_state)
+        response_time *= np.repeat(np.where(constituency == 1, 1.2, 1), counts)
+        work_time = self.sampler.work_time(len(sample_cost), sample_cost, self.work_time_lower_bound, self.random_state)
+
+        first_step = self.episode_counter == 0
+        success_rate = np.where(first_step,
+                                self.random_state.uniform(0.8, 1, self.num_envs),
+                                self.action_space.success_rate[performed_actions])
+
+        # Same constituency + Same candidate => success rate = 0, the step is punished and discarded
+        punished = ~first_step & ~self.action_space.valid[performed_actions]
+        applied = ~punished
+
+        # Rewards of the strings before the success rate of their work order, which factors out of the sum.
+        # reduceat gives the first sample of the next segment for empty segments, they are left out
+        reward_samples = (1 / np.maximum(response_time, self.min_response_time) -
+                          (work_time - self.work_time_lower_bound) * (work_time - self.work_time_upper_bound))
+        reward = np.zeros(self.num_envs)
+        time = np.full(self.num_envs, -np.inf)
+        if nonempty.any():
+            reward[nonempty] = np.add.reduceat(reward_samples, starts[nonempty])
+            time[nonempty] = np.maximum.reduceat(response_time + work_time, starts[nonempty])
+        reward *= success_rate / np.maximum(num_strings, 1)
+        money = cost_cents * num_strings
+
+        # In case of additional translation
+        time += (candidate == 2) * self.translation_time
+        money += (candidate == 2) * self.translation_cost
+
+        self.sla -= np.where(applied, time, 0)
+        self.budget -= np.where(applied, money, 0)
+        self.num_translation_string -= np.where(applied, np.ceil(num_strings * success_rate), 0).astype(np.int64)
+        self.cumulative_success_rate += np.where(applied, (1 - self.cumulative_success_rate) * success_rate, 0)
+        self.episode_counter += applied
+
+        self.last_punctual_observation[applied, 0] = self.cumulative_success_rate[applied]
+        self.last_punctual_observation[applied, 1] = actions[applied]
+
+        rewards = np.where(punished, -9999, reward)
+
+        self._terminals = self._terminalMask()
+        if self._terminals.any():
+            self.reset(self._mode, self._terminals)
+
+        return rewards
+
+    def _terminalMask(self):
+        return ((1 - self.cumulative_success_rate) <= self.tolerance_rate) | \
+               (self.num_translation_string <= 0) | \
+               (self.sla <= 0) | \
+               (self.budget <= 0)
+
+    def get_action_dimension(self):
+        return [(1,), (1,)]
+
+    def get_num_actions(self):
+        return self.action_space.n
+
+    def inTerminalState(self):
+        """
+            Terminal mask of the last step, taken before the finished work orders were reset
+        """
+        return self._terminals
+
+    def observe(self):
+        """
+            Returns the observations of all work orders as an array of size [num_envs, 2]
+        """
+        return self.last_punctual_observation.copy()
+
+    def get_constraints(self):
+        return [self.sla, self.budget]
+
+    def get_episode_counter(self):
+        return self.episode_counter
+
+    def get_state(self):
+        """
+            Returns the episode states of all work orders as an array of STATE_DTYPE with size [num_envs]
+        """
+        states = np.empty(self.num_envs, dtype=STATE_DTYPE)
+        states["num_translation_string"] = self.num_translation_string
+        states["num_candidates"] = self.num_candidates
+        states["sla"] = self.sla
+        states["budget"] = self.budget
+        states["cumulative_success_rate"] = self.cumulative_success_rate
+        states["episode_counter"] = self.episode_counter
+        states["last_action"] = self.last_punctual_observation[:, 1]
+        return states
+
+    def set_state(self, states, mask=None):
+        """
+            Loads an array of STATE_DTYPE (e.g. given by TransplanSimulator.fork or get_state) into the work 
+            orders selected by mask (all of them if mask is None)
+        """
+        if mask is None:
+            mask = np.ones(self.num_envs, dtype=bool)
+        self.num_translation_string[mask] = states["num_translation_string"]
+        self.num_candidates[mask] = states["num_candidates"]
+        self.sla[mask] = states["sla"]
+        self.budget[mask] = states["budget"]
+        self.cumulative_success_rate[mask] = states["cumulative_success_rate"]
+        self.episode_counter[mask] = states["episode_counter"]
+        self.last_punctual_observation[mask, 0] = states["cumulative_success_rate"]
+        self.last_punctual_observation[mask, 1] = states["last_action"]
+        self._terminals[mask] = False
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(1)
+    mySimulator = VectorTransplanSimulator(rng, num_envs=4)
+
+    print (mySimulator.act(np.array([110, 5, 63, 110])))
+    print (mySimulator.inTerminalState())
+    print (mySimulator.get_constraints())
+    print (mySimulator.observe())
@@ -4,12 +4,20 @@ sys.path.insert(0, os.path.abspath(".."))
 
 from keras.optimizers import SGD,RMSprop
 from keras import backend as K
+from keras.models import Model
+from keras.layers import Input, Lambda
 from interface import Algorithm
 from algorithms.DQN import DQN # Default Neural network used
 
 class QNetwork(Algorithm):
     """
     Deep Q-learning network using Keras (with any backend)
+
+    The target network is synchronized with the online network every freeze_interval updates or, if tau > 0, 
+    moved towards it by a soft update target = tau * online + (1 - tau) * target after every update.
+
+    When the network is the default DQN and is only made of dense layers (histories of at most 3 steps), Q-values for 
+    action selection are computed with NumPy on a copy of the online weights, refreshed every mirror_interval updates.
     """
 
     def __init__(self, 
@@ -21,9 +29,11 @@ class QNetwork(Algorithm):
                  freeze_interval=1000, 
                  batch_size=32, 
                  update_rule="rmsprop", 
-                 random_state=np.random.RandomState(), 
+                 random_state=np.random.default_rng(), 
                  double_Q=False, 
-                 neural_network=DQN):
+                 neural_network=DQN,
+                 tau=0,
+                 mirror_interval=1):
 
         Algorithm.__init__(self, environment, batch_size)
         
@@ -34,11 +44,20 @@ class QNetwork(Algorithm):
         self._update_rule = update_rule
         self._freeze_interval = freeze_interval
         self._double_Q = double_Q
+        self._tau = tau
+        self._mirror_interval = mirror_interval
         self._random_state = random_state
         self.update_counter = 0
                 
         Q_net = neural_network(self._batch_size, self._action_dimensions, self._num_actions, self._random_state)
         self.q_vals, self.params = Q_net._buildDQN()
+
+        # Training model sharing the layers of self.q_vals: the one-hot action mask selects the Q-value of the
+        # action taken, so that the loss only involves the targets of the batch
+        action_mask = Input(shape=(self._num_actions,))
+        q_action = Lambda(lambda x: K.sum(x[0] * x[1], axis=1, keepdims=True))([self.q_vals.output, action_mask])
+        self.q_train = Model(inputs=self.q_vals.inputs + [action_mask], outputs=q_action)
+        self._actions_one_hot = np.eye(self._num_actions, dtype='float32')
         
         self._compile()
 
@@ -47,6 +66,11 @@ class QNetwork(Algorithm):
 
         self._resetQHat()
 
+        # The NumPy mirror follows DQN._buildDQN: flattened observations, then dense layers with relu activations
+        # except for the last one. Convolutions on long histories and other networks are left to Keras.
+        self._use_mirror = neural_network is DQN and all(dim[0] <= 3 for dim in self._action_dimensions)
+        self._updateMirror()
+
     def getAllParams(self):
         """ Get all parameters used by the learning algorithm
 
@@ -69,8 +93,9 @@ class QNetwork(Algorithm):
         """
         for i, p in enumerate(self.params):
             K.set_value(p,list_of_values[i])
+        self._updateMirror()
 
-    def train(self, states_val, actions_val, rewards_val, next_states_val, terminals_val):
+    def train(self, states_val, actions_val, rewards_val, next_states_val, terminals_val, weights=None):
         """
         Train the Q-network from one batch of data.
 
@@ -88,49 +113,71 @@ class QNetwork(Algorithm):
             with size [batch_size * history size * size of punctual observation (which is 2D,1D or scalar)].
         terminals_val : numpy array of booleans with size [self._batch_size]
             terminals[i] is True if the transition leads to a terminal state and False otherwise
+        weights : numpy array of floats with size [self._batch_size]
+            Per-sample loss weights, e.g. importance sampling weights of prioritized replay (uniform if None)
 
         Returns
         -------
-        Average loss of the batch training (RMSE)
-        Individual (square) losses for each tuple
+        Average loss of the batch training (RMSE of the Q-values of the actions taken)
+        Individual (square) losses for each tuple, only computed with weights (for prioritized replay), None otherwise. 
+        They take a forward pass of the online network on the current states that uniform replay has no use for.
         """
         
-        if self.update_counter % self._freeze_interval == 0:
+        if self._tau == 0 and self.update_counter % self._freeze_interval == 0:
             self._resetQHat()
-        
-        next_q_vals = self.next_q_vals.predict(next_states_val.tolist())
-        
+
+        batch_size = len(actions_val)
+        batch_range = np.arange(batch_size)
+        states_val = self._inputs(states_val)
+        next_states_val = self._inputs(next_states_val)
+
+        next_q_vals = self.next_q_vals.predict_on_batch(next_states_val)
+
+        # The online network evaluates the current states when the individual losses are needed and, with double Q, 
+        # the next states, in a single pass on the stacked inputs when both are needed
+        individual_losses = weights is not None
+        online_inputs = []
+        if individual_losses:
+            online_inputs.append(states_val)
         if(self._double_Q==True):
-            next_q_vals_current_qnet=self.q_vals.predict(next_states_val.tolist())
-            argmax_next_q_vals=np.argmax(next_q_vals_current_qnet, axis=1)
-            max_next_q_vals=next_q_vals[np.arange(self._batch_size),argmax_next_q_vals].reshape((-1, 1))
+            online_inputs.append(next_states_val)
+        if len(online_inputs) == 1:
+            online_q_vals = self.q_vals.predict_on_batch(online_inputs[0])
+        elif len(online_inputs) == 2:
+            online_q_vals = self.q_vals.predict_on_batch([np.concatenate(inputs) for inputs in zip(*online_inputs)])
+
+        if(self._double_Q==True):
+            argmax_next_q_vals=np.argmax(online_q_vals[-batch_size:], axis=1)
+            max_next_q_vals=next_q_vals[batch_range, argmax_next_q_vals]
         else:
-            max_next_q_vals=np.max(next_q_vals, axis=1, keepdims=True)
+            max_next_q_vals=np.max(next_q_vals, axis=1)
 
-        not_terminals=np.invert(terminals_val).astype(float)
-        
-        target = rewards_val + not_terminals * self._df * max_next_q_vals.reshape((-1))
+        not_terminals=np.invert(terminals_val).astype('float32')
         
-        q_vals=self.q_vals.predict(states_val.tolist())
+        target = (rewards_val + not_terminals * self._df * max_next_q_vals).astype('float32')
 
-        # In order to obtain the individual losses, we predict the current Q_vals and calculate the diff
-        q_val=q_vals[np.arange(self._batch_size), actions_val]       
-        diff = - q_val + target 
-        loss_ind=pow(diff,2)
-                
-        q_vals[  np.arange(self._batch_size), actions_val  ] = target
-                
-        # Is it possible to use something more flexible than this? 
-        # Only some elements of next_q_vals are actual value that I target. 
-        # My loss should only take these into account.
-        # Workaround here is that many values are already "exact" in this update
-        loss=self.q_vals.train_on_batch(states_val.tolist() , q_vals ) 
+        if individual_losses:
+            diff = - online_q_vals[batch_range, actions_val] + target 
+            loss_ind=pow(diff,2)
+        else:
+            loss_ind=None
+
+        # The loss only takes the Q-values of the actions taken into account
+        loss=self.q_train.train_on_batch(states_val + [self._actions_one_hot[actions_val]], target.reshape((-1, 1)), sample_weight=weights) 
                 
         self.update_counter += 1        
+        if self._tau > 0:
+            self._softUpdateQHat()
+        if self.update_counter % self._mirror_interval == 0:
+            self._updateMirror()
 
-        # loss*self._n_actions = np.average(loss_ind)
         return np.sqrt(loss), loss_ind
 
+    def _inputs(self, states_val):
+        """ Contiguous float32 input arrays of the network, one per observation
+        """
+        return [np.ascontiguousarray(observations, dtype='float32') for observations in states_val]
+
 
     def get_qvalue(self, state_val):
         """ Get the q values for one belief state
@@ -143,7 +190,7 @@ class QNetwork(Algorithm):
         -------
         The q values for the provided belief state
         """ 
-        return self.q_vals.predict([np.expand_dims(state,axis=0) for state in state_val])[0]
+        return self._qvalues([np.expand_dims(state,axis=0) for state in state_val])[0]
 
     def get_best_action(self, state, *args, **kwargs):
         """ Get the best action for a pseudo-state
@@ -159,25 +206,70 @@ class QNetwork(Algorithm):
         q_vals = self.get_qvalue(state)
 
         return np.argmax(q_vals),np.max(q_vals)
+
+    def get_best_action_batch(self, states, *args, **kwargs):
+        """ Get the best actions for a batch of pseudo-states
+
+        Arguments
+        ---------
+        states : list with one numpy array per observation, states[i][j] being observation i of pseudo-state j
+
+        Returns
+        -------
+        The best actions : numpy array of int
+        Their Q-values : numpy array of float
+        """
+        q_vals = self._qvalues(states)
+        actions = np.argmax(q_vals, axis=1)
+
+        return actions, q_vals[np.arange(len(actions)), actions]
+
+    def _qvalues(self, states):
+        """ Q-values of the online network for a batch of pseudo-states, from the NumPy mirror when possible
+        """
+        if not self._use_mirror:
+            return self.q_vals.predict_on_batch(self._inputs(states))
+
+        x = np.concatenate([np.reshape(observations, (len(observations), -1)) for observations in states], axis=1)
+        x = x.astype('float32', copy=False)
+        for i in range(0, len(self._mirror) - 2, 2):
+            x = np.maximum(x @ self._mirror[i] + self._mirror[i + 1], 0)
+        return x @ self._mirror[-2] + self._mirror[-1]
+
+    def _updateMirror(self):
+        """ Copy the weights of the online network to the NumPy mirror
+        """
+        if self._use_mirror:
+            self._mirror = self.q_vals.get_weights()
         
     def _compile(self):
-        """ Compile self.q_vals
+        """ Compile self.q_train, which trains the layers of self.q_vals
         """
         
         if (self._update_rule=="sgd"):
-            optimizer = SGD(lr=self._lr, momentum=self._momentum, nesterov=False, clipnorm=self._clip_norm)
+            optimizer = SGD(learning_rate=self._lr, momentum=self._momentum, nesterov=False, clipnorm=self._clip_norm)
         elif (self._update_rule=="rmsprop"):
-            optimizer = RMSprop(lr=self._lr, rho=self._rho, epsilon=self._rms_epsilon, clipnorm=self._clip_norm)
+            optimizer = RMSprop(learning_rate=self._lr, rho=self._rho, epsilon=self._rms_epsilon, clipnorm=self._clip_norm)
         else:
             raise Exception('The update_rule '+self._update_rule+' is not implemented.')
         
-        self.q_vals.compile(optimizer=optimizer, loss='mse')
+        self.q_train.compile(optimizer=optimizer, loss='mse')
+
+    def set_learning_rate(self, lr):
+        """ Set the learning rate of the optimizer in place, keeping its state
+        """
+        Algorithm.set_learning_rate(self, lr)
+        K.set_value(self.q_train.optimizer.learning_rate, lr)
 
     def _resetQHat(self):
         """ Set the target Q-network weights equal to the main Q-network weights
         """
-        
-        for _,(param,next_param) in enumerate(zip(self.params, self.next_params)):
-            K.set_value(next_param,K.get_value(param))
+        self._next_weights = self.q_vals.get_weights()
+        self.next_q_vals.set_weights(self._next_weights)
 
-        self._compile() # recompile to take into account new optimizer parameters that may have changed since
+    def _softUpdateQHat(self):
+        """ Move the target Q-network weights towards the main Q-network weights with rate self._tau
+        """
+        for next_weight, weight in zip(self._next_weights, self.q_vals.get_weights()):
+            next_weight += self._tau * (weight - next_weight)
+        self.next_q_vals.set_weights(self._next_weights)
@@ -0,0 +1,256 @@
+import numpy as np
+import os, sys
+sys.path.insert(0, os.path.abspath(".."))
+
+from interface import Algorithm
+
+class NumpyQNetwork(Algorithm):
+    """
+    Deep Q-learning network with NumPy forward and backward passes, without any deep-learning framework.
+
+    The network is the fully-connected part of DQN: observations are flattened and concatenated, then go through
+    dense layers of hidden_units with relu activations and a linear output layer with one Q-value per action.
+    Histories are not convolved, the whole history of every observation is part of the input.
+    Parameters are given by getAllParams() in the same order as QNetwork (kernel then bias of each layer).
+
+    The target network is synchronized with the online network every freeze_interval updates or, if tau > 0,
+    moved towards it by a soft update target = tau * online + (1 - tau) * target after every update.
+    """
+
+    def __init__(self,
+                 environment,
+                 rho=0.9,
+                 rms_epsilon=0.0001,
+                 momentum=0,
+                 clip_norm=0,
+                 freeze_interval=1000,
+                 batch_size=32,
+                 update_rule="rmsprop",
+                 random_state=np.random.default_rng(),
+                 double_Q=False,
+                 tau=0,
+                 hidden_units=(50, 50)):
+
+        Algorithm.__init__(self, environment, batch_size)
+
+        if (update_rule not in ("sgd", "rmsprop")):
+            raise Exception('The update_rule '+update_rule+' is not implemented.')
+
+        self._rho = rho
+        self._rms_epsilon = rms_epsilon
+        self._momentum = momentum
+        self._clip_norm = clip_norm
+        self._update_rule = update_rule
+        self._freeze_interval = freeze_interval
+        self._double_Q = double_Q
+        self._tau = tau
+        self._random_state = random_state
+        self.update_counter = 0
+
+        num_actions = self._num_actions if isinstance(self._num_actions, int) else len(self._num_actions)
+        input_size = sum(int(np.prod(dim)) for dim in self._action_dimensions)
+        sizes = [input_size] + list(hidden_units) + [num_actions]
+        # Glorot uniform kernels and zero biases, as the Dense layers of Keras
+        self.params = []
+        for fan_in, fan_out in zip(sizes[:-1], sizes[1:]):
+            limit = np.sqrt(6. / (fan_in + fan_out))
+            self.params.append(self._random_state.uniform(-limit, limit, (fan_in, fan_out)).astype('float32'))
+            self.params.append(np.zeros(fan_out, dtype='float32'))
+        # Optimizer state: RMSprop accumulators or SGD velocities
+        self._accumulators = [np.zeros_like(p) for p in self.params]
+
+        self._resetQHat()
+
+    def getAllParams(self):
+        """ Get all parameters used by the learning algorithm
+
+        Returns
+        -------
+        Values of the parameters: list of numpy arrays
+        """
+        return [p.copy() for p in self.params]
+
+    def setAllParams(self, list_of_values):
+        """ Set all parameters used by the learning algorithm
+
+        Arguments
+        ---------
+        list_of_values : list of numpy arrays
+             list of the parameters to be set (same order than given by getAllParams()).
+        """
+        for p, value in zip(self.params, list_of_values):
+            p[...] = value
+
+    def train(self, states_val, actions_val, rewards_val, next_states_val, terminals_val, weights=None):
+        """
+        Train the Q-network from one batch of data.
+
+        Parameters
+        -----------
+        states_val : numpy array of objects
+            Each object is a numpy array that relates to one of the observations
+            with size [batch_size * history size * size of punctual observation (which is 2D,1D or scalar)].
+        actions_val : numpy array of integers with size [self._batch_size]
+            actions[i] is the action taken after having observed states[:][i].
+        rewards_val : numpy array of floats with size [self._batch_size]
+            rewards[i] is the reward obtained for taking actions[i-1].
+        next_states_val : numpy array of objects
+            Each object is a numpy array that relates to one of the observations
+            with size [batch_size * history size * size of punctual observation (which is 2D,1D or scalar)].
+        terminals_val : numpy array of booleans with size [self._batch_size]
+            terminals[i] is True if the transition leads to a terminal state and False otherwise
+        weights : numpy array of floats with size [self._batch_size]
+            Per-sample loss weights, e.g. importance sampling weights of prioritized replay (uniform if None)
+
+        Returns
+        -------
+        Average loss of the batch training (RMSE of the Q-values of the actions taken)
+        Individual (square) losses for each tuple
+        """
+
+        if self._tau == 0 and self.update_counter % self._freeze_interval == 0:
+            self._resetQHat()
+
+        batch_size = len(actions_val)
+        batch_range = np.arange(batch_size)
+        x = self._inputs(states_val)
+        next_x = self._inputs(next_states_val)
+
+        next_q_vals, _ = self._forward(self.next_params, next_x)
+
+        # The online network evaluates the current states and, with double Q, the next states in a single pass
+        if(self._double_Q==True):
+            stacked_q_vals, activations = self._forward(self.params, np.concatenate([x, next_x]))
+            q_vals = stacked_q_vals[:batch_size]
+            activations = [a[:batch_size] for a in activations]
+            argmax_next_q_vals=np.argmax(stacked_q_vals[batch_size:], axis=1)
+            max_next_q_vals=next_q_vals[batch_range, argmax_next_q_vals]
+        else:
+            q_vals, activations = self._forward(self.params, x)
+            max_next_q_vals=np.max(next_q_vals, axis=1)
+
+        not_terminals=np.invert(terminals_val).astype('float32')
+
+        target = (rewards_val + not_terminals * self._df * max_next_q_vals).astype('float32')
+
+        diff = q_vals[batch_range, actions_val] - target
+        loss_ind=pow(diff,2)
+        if weights is None:
+            weights = np.ones(batch_size, dtype='float32')
+        loss = np.mean(weights * loss_ind)
+
+        # Gradient of the mean weighted square error, which only involves the Q-values of the actions taken
+        delta = np.zeros_like(q_vals)
+        delta[batch_range, actions_val] = 2 * weights * diff / batch_size
+        self._applyGradients(self._backward(activations, delta))
+
+        self.update_counter += 1
+        if self._tau > 0:
+            self._softUpdateQHat()
+
+        return np.sqrt(loss), loss_ind
+
+    def get_qvalue(self, state_val):
+        """ Get the q values for one belief state
+
+        Arguments
+        ---------
+        state_val : one belief state
+
+        Returns
+        -------
+        The q values for the provided belief state
+        """
+        return self._forward(self.params, self._inputs([np.expand_dims(state,axis=0) for state in state_val]))[0][0]
+
+    def get_best_action(self, state, *args, **kwargs):
+        """ Get the best action for a pseudo-state
+
+        Arguments
+        ---------
+        state : one pseudo-state
+
+        Returns
+        -------
+        The best action : int
+        """
+        q_vals = self.get_qvalue(state)
+
+        return np.argmax(q_vals),np.max(q_vals)
+
+    def get_best_action_batch(self, states, *args, **kwargs):
+        """ Get the best actions for a batch of pseudo-states
+
+        Arguments
+        ---------
+        states : list with one numpy array per observation, states[i][j] being observation i of pseudo-state j
+
+        Returns
+        -------
+        The best actions : numpy array of int
+        Their Q-values : numpy array of float
+        """
+        q_vals = self._forward(self.params, self._inputs(states))[0]
+        actions = np.argmax(q_vals, axis=1)
+
+        return actions, q_vals[np.arange(len(actions)), actions]
+
+    def _inputs(self, states_val):
+        """ Contiguous float32 input matrix of the network: the flattened observations side by side
+        """
+        return np.concatenate([np.reshape(observations, (len(observations), -1)) for observations in states_val], axis=1).astype('float32', copy=False)
+
+    def _forward(self, params, x):
+        """ Q-values of the network with parameters params, and the inputs of each of its layers
+        """
+        activations = [x]
+        for i in range(0, len(params) - 2, 2):
+            x = np.maximum(x @ params[i] + params[i + 1], 0)
+            activations.append(x)
+        return x @ params[-2] + params[-1], activations
+
+    def _backward(self, activations, delta):
+        """ Gradients of the parameters given the gradient delta of the loss with respect to the Q-values
+        """
+        grads = [None] * len(self.params)
+        for layer in reversed(range(len(self.params) // 2)):
+            grads[2 * layer] = activations[layer].T @ delta
+            grads[2 * layer + 1] = np.sum(delta, axis=0)
+            if layer > 0:
+                delta = (delta @ self.params[2 * layer].T) * (activations[layer] > 0)
+        return grads
+
+    def _applyGradients(self, grads):
+        """ One step of the update rule, in place (same formulas as the Keras optimizers)
+        """
+        for p, g, a in zip(self.params, grads, self._accumulators):
+            if self._clip_norm > 0:
+                norm = np.sqrt(np.sum(g * g))
+                if norm > self._clip_norm:
+                    g = g * (self._clip_norm / norm)
+            if (self._update_rule=="sgd"):
+                a *= self._momentum
+                a -= self._lr * g
+                p += a
+            else:
+                a *= self._rho
+                a += (1 - self._rho) * g * g
+                p -= self._lr * g / (np.sqrt(a) + self._rms_epsilon)
+
+    def _resetQHat(self):
+        """ Set the target Q-network weights equal to the main Q-network weights
+        """
+        self.next_params = self.getAllParams()
+
+    def _softUpdateQHat(self):
+        """ Move the target Q-network weights towards the main Q-network weights with rate self._tau
+        """
+        for next_param, param in zip(self.next_params, self.params):
+            next_param += self._tau * (param - next_param)
+
+
+if __name__ == "__main__":
+    from TransplanSimulator import TransplanSimulator
+    simulator = TransplanSimulator(np.random.default_rng(123456))
+    q_network = NumpyQNetwork(simulator, random_state=np.random.default_rng(123456))
+    print (q_network.get_best_action([np.zeros(dim) for dim in simulator.get_action_dimension()]))
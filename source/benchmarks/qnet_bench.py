@@ -0,0 +1,118 @@
+"""
+Gradient steps per second of the Q-network backends, in the JSON format of simulator_bench.
+
+Run from the source directory:
+    python -m benchmarks.qnet_bench --output qnet.json
+    python -m benchmarks.qnet_bench --backends numpy --output qnet.json
+
+The keras backend is also measured with the training step QNetwork used before its masked loss ("legacy": predict
+on the next states, on the next states again for double Q, on the current states, then train_on_batch on the whole
+output), on the same networks, so that both steps can be compared on one machine. Results can be gated with
+    python -m benchmarks.simulator_bench compare baseline.json current.json
+"""
+
+import sys
+import time
+import platform
+import argparse
+import json
+
+import numpy as np
+
+from TransplanSimulator import TransplanSimulator
+from benchmarks.simulator_bench import _timed
+
+BACKENDS = ["keras", "numpy"]
+
+def _batch(simulator, batch_size, rng):
+    """
+        Random batch with the types of DataSet.randomBatch
+    """
+    dims = simulator.get_action_dimension()
+    states = np.zeros(len(dims), dtype='object')
+    next_states = np.zeros(len(dims), dtype='object')
+    for i, dim in enumerate(dims):
+        states[i] = rng.random((batch_size,) + dim).astype('float32')
+        next_states[i] = rng.random((batch_size,) + dim).astype('float32')
+    actions = rng.integers(0, simulator.get_num_actions(), batch_size)
+    rewards = rng.normal(size=batch_size).astype('float32')
+    terminals = rng.random(batch_size) < 0.1
+    return states, actions, rewards, next_states, terminals
+
+def legacy_train(q_network):
+    """
+        Training step of QNetwork before the masked loss, on the networks of q_network
+    """
+    from keras.optimizers import RMSprop
+    q_network.q_vals.compile(optimizer=RMSprop(lr=q_network.get_learning_rate()), loss='mse')
+
+    def train(states_val, actions_val, rewards_val, next_states_val, terminals_val, weights=None):
+        batch_size = len(actions_val)
+        next_q_vals = q_network.next_q_vals.predict(next_states_val.tolist())
+        if q_network._double_Q:
+            argmax_next_q_vals = np.argmax(q_network.q_vals.predict(next_states_val.tolist()), axis=1)
+            max_next_q_vals = next_q_vals[np.arange(batch_size), argmax_next_q_vals]
+        else:
+            max_next_q_vals = np.max(next_q_vals, axis=1)
+        target = rewards_val + np.invert(terminals_val).astype(float) * q_network.get_discount_factor() * max_next_q_vals
+        q_vals = q_network.q_vals.predict(states_val.tolist())
+        loss_ind = (target - q_vals[np.arange(batch_size), actions_val]) ** 2
+        q_vals[np.arange(batch_size), actions_val] = target
+        loss = q_network.q_vals.train_on_batch(states_val.tolist(), q_vals, sample_weight=weights)
+        return np.sqrt(loss), loss_ind
+
+    return train
+
+def _q_network(backend, simulator, double_Q, seed):
+    if backend == "numpy":
+        from algorithms.q_net_numpy import NumpyQNetwork
+        return NumpyQNetwork(simulator, random_state=np.random.default_rng(seed), double_Q=double_Q)
+    from algorithms.q_net_keras import QNetwork
+    return QNetwork(simulator, random_state=np.random.default_rng(seed), double_Q=double_Q)
+
+def bench_train(backend, double_Q, prioritized, min_time, batch_size=32, legacy=False, seed=123456):
+    simulator = TransplanSimulator(np.random.default_rng(seed))
+    q_network = _q_network(backend, simulator, double_Q, seed)
+    train = legacy_train(q_network) if legacy else q_network.train
+    rng = np.random.default_rng(seed)
+    batch = _batch(simulator, batch_size, rng)
+    # Prioritized replay gives importance sampling weights, and uses the individual losses
+    weights = rng.random(batch_size).astype('float32') if prioritized else None
+
+    steps, elapsed = _timed(lambda: train(*batch, weights=weights), min_time)
+    return {"steps_per_sec": steps / elapsed}
+
+def run(backends=BACKENDS, min_time=2., batch_size=32):
+    results = {}
+    for backend in backends:
+        steps = ["legacy", "masked"] if backend == "keras" else ["masked"]
+        for step in steps:
+            for double_Q in (False, True):
+                for prioritized in (False, True):
+                    name = "train/backend={}/step={}/double_Q={}/prioritized={}".format(backend, step, double_Q, prioritized)
+                    results[name] = bench_train(backend, double_Q, prioritized, min_time, batch_size, legacy=step == "legacy")
+                    print (name, results[name])
+
+    return {"meta": {"python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "machine": platform.machine(),
+                     "processor": platform.processor(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Q-network training throughput benchmarks")
+    parser.add_argument("--output", default="qnet_bench_output.json")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=BACKENDS)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-time", type=float, default=2., help="seconds spent on each measurement")
+    args = parser.parse_args(argv)
+
+    results = run(args.backends, args.min_time, args.batch_size)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,233 @@
+"""
+Throughput benchmarks of the simulators, with a JSON baseline and a regression gate.
+
+Run from the source directory:
+    python -m benchmarks.simulator_bench run --output baseline.json
+    python -m benchmarks.simulator_bench run --output current.json
+    python -m benchmarks.simulator_bench compare baseline.json current.json --threshold 0.1
+
+compare exits with status 1 when a throughput of current.json is lower than the baseline by more than threshold.
+Throughputs are measured after a warm-up, one-time costs (imports, loading of the logs, caches) are reported
+separately as setup_sec and are not gated. The vector_vs_scalar rows give the transitions per second of the vector 
+simulator over the steps per second of the scalar one (numpy engine) at the same size.
+"""
+
+import sys
+import json
+import time
+import platform
+import argparse
+import tracemalloc
+
+import numpy as np
+
+from TransplanSimulator import TransplanSimulator
+from VectorTransplanSimulator import VectorTransplanSimulator
+from helper.helpers import synthesize
+from helper.samplers import ParametricSampler, EmpiricalSampler
+
+SIZES = [100, 1000, 10000, 100000]
+ENGINES = ["numpy", "pandas", "expectation"]
+SAMPLERS = ["parametric", "empirical"]
+# Metrics compared by the regression gate, higher is better
+THROUGHPUT_METRICS = ["steps_per_sec", "episodes_per_sec", "samples_per_sec", "transitions_per_sec"]
+
+def _sampler(name):
+    if name == "empirical":
+        return EmpiricalSampler("en-gb")
+    return ParametricSampler()
+
+def _warm_up(function, calls):
+    for _ in range(calls):
+        function()
+
+def _timed(function, min_time, min_calls=3, warmup=3):
+    """
+        Calls function until min_time seconds elapsed (at least min_calls times), after warmup calls that are not 
+        timed. Returns (calls, seconds).
+    """
+    _warm_up(function, warmup)
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        function()
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if calls >= min_calls and elapsed >= min_time:
+            return calls, elapsed
+
+def _bytes_per_call(function, calls=20, warmup=3):
+    """
+        Average size of the memory blocks allocated by one call (peak traced memory, reset before each call), 
+        after warmup calls that are not traced
+    """
+    _warm_up(function, warmup)
+    tracemalloc.start()
+    total = 0
+    for _ in range(calls):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function()
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / calls
+
+def bench_simulator(num_translation_string, engine, sampler, min_time, seed=123456):
+    start = time.perf_counter()
+    simulator = TransplanSimulator(np.random.default_rng(seed),
+                                   num_translation_string=num_translation_string,
+                                   budget=1e12,
+                                   engine=engine,
+                                   sampler=_sampler(sampler))
+    actions = np.random.default_rng(seed).integers(0, simulator.get_num_actions(), 4096)
+    counter = [0]
+    simulator.reset(-1)
+    simulator.act(actions[0])
+    if engine == "expectation":
+        # Fills the cache of expectations, one entry per (cost, constituency) of the action space
+        for action in range(simulator.get_num_actions()):
+            simulator.act(action)
+    setup_time = time.perf_counter() - start
+
+    def step():
+        if simulator.inTerminalState():
+            simulator.reset(-1)
+        simulator.act(actions[counter[0] % len(actions)])
+        counter[0] += 1
+
+    def episode():
+        simulator.reset(-1)
+        while not simulator.inTerminalState():
+            simulator.act(actions[counter[0] % len(actions)])
+            counter[0] += 1
+
+    simulator.reset(-1)
+    steps, steps_time = _timed(step, min_time)
+    episodes, episodes_time = _timed(episode, min_time)
+    resets, resets_time = _timed(lambda: simulator.reset(-1), min_time / 10, min_calls=100)
+    simulator.reset(-1)
+    return {"steps_per_sec": steps / steps_time,
+            "episodes_per_sec": episodes / episodes_time,
+            "resets_per_sec": resets / resets_time,
+            "bytes_per_step": _bytes_per_call(step),
+            "setup_sec": setup_time}
+
+def bench_vector_simulator(num_envs, num_translation_string, sampler, min_time, seed=123456):
+    start = time.perf_counter()
+    simulator = VectorTransplanSimulator(np.random.default_rng(seed),
+                                         num_envs=num_envs,
+                                         num_translation_string=num_translation_string,
+                                         budget=1e12,
+                                         sampler=_sampler(sampler))
+    rng = np.random.default_rng(seed)
+
+    def step():
+        simulator.act(rng.integers(0, simulator.get_num_actions(), num_envs))
+
+    step()
+    setup_time = time.perf_counter() - start
+    steps, steps_time = _timed(step, min_time)
+    return {"steps_per_sec": steps / steps_time,
+            "transitions_per_sec": steps * num_envs / steps_time,
+            "bytes_per_step": _bytes_per_call(step, calls=5),
+            "setup_sec": setup_time}
+
+def bench_synthesize(sample_size, min_time, seed=123456):
+    rng = np.random.default_rng(seed)
+
+    def draw():
+        synthesize("Gaussian", sample_size, {"mean": 0.1, "std": 117}, rng)
+        synthesize("Pareto", sample_size, {"shape": 0.825, "scale": 9}, rng)
+
+    calls, elapsed = _timed(draw, min_time)
+    return {"samples_per_sec": 2 * calls * sample_size / elapsed}
+
+def run(sizes=SIZES, engines=ENGINES, samplers=SAMPLERS, min_time=0.5, max_pandas_size=1000, num_envs=64):
+    results = {}
+    for size in sizes:
+        results["synthesize/size={}".format(size)] = bench_synthesize(size, min_time)
+        for engine in engines:
+            # The row-wise pandas engine takes seconds per step on large work orders
+            if engine == "pandas" and size > max_pandas_size:
+                continue
+            for sampler in samplers:
+                if engine == "expectation" and sampler != "parametric":
+                    continue
+                name = "simulator/engine={}/sampler={}/size={}".format(engine, sampler, size)
+                results[name] = bench_simulator(size, engine, sampler, min_time)
+                print (name, results[name])
+        for sampler in samplers:
+            if size * num_envs > 10 ** 7:
+                continue
+            name = "vector/envs={}/sampler={}/size={}".format(num_envs, sampler, size)
+            results[name] = bench_vector_simulator(num_envs, size, sampler, min_time)
+            print (name, results[name])
+            # Transitions of the vector simulator per step of the scalar one, at the same size
+            scalar = results.get("simulator/engine=numpy/sampler={}/size={}".format(sampler, size))
+            if scalar is not None:
+                speedup_name = "vector_vs_scalar/envs={}/sampler={}/size={}".format(num_envs, sampler, size)
+                results[speedup_name] = {"speedup": results[name]["transitions_per_sec"] / scalar["steps_per_sec"]}
+                print (speedup_name, results[speedup_name])
+
+    return {"meta": {"python": platform.python_version(),
+                     "numpy": np.__version__,
+                     "machine": platform.machine(),
+                     "processor": platform.processor(),
+                     "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results}
+
+def compare(baseline, current, threshold=0.1):
+    """
+        Returns the list of (benchmark, metric, baseline value, current value) whose throughput dropped by more
+        than threshold (relative) from baseline to current. Benchmarks missing from one of the files are skipped.
+    """
+    regressions = []
+    for name, metrics in baseline["results"].items():
+        if name not in current["results"]:
+            continue
+        for metric in THROUGHPUT_METRICS:
+            if metric in metrics and metric in current["results"][name]:
+                if current["results"][name][metric] < metrics[metric] * (1 - threshold):
+                    regressions.append((name, metric, metrics[metric], current["results"][name][metric]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulator throughput benchmarks")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--output", default="bench_output.json")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    run_parser.add_argument("--engines", nargs="+", default=ENGINES, choices=ENGINES)
+    run_parser.add_argument("--samplers", nargs="+", default=SAMPLERS, choices=SAMPLERS)
+    run_parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent on each measurement")
+
+    compare_parser = subparsers.add_parser("compare", help="fail when current is slower than baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1, help="tolerated relative slowdown")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run(args.sizes, args.engines, args.samplers, args.min_time)
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        return 0
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name, metric, before, after in regressions:
+            print ("REGRESSION {} {}: {:.1f} -> {:.1f} ({:+.1%})".format(name, metric, before, after, after / before - 1))
+        if not regressions:
+            print ("No throughput regression beyond {:.0%}".format(args.threshold))
+        return 1 if regressions else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -221,6 +221,78 @@ class EpsilonController(Controller):
 
 
 
+class ImportanceSamplingController(Controller):
+    """ A controller that anneals the exponent beta of the importance sampling weights of prioritized replay 
+    (NeuralAgent with exp_priority > 0) linearly from initial_beta to beta_max.
+    
+    Parameters
+    ----------
+    initial_beta : float
+        Start beta
+    beta_growths : int
+        How many updates are necessary for beta to reach beta_max
+    beta_max : float
+        End beta, 1 fully compensates the bias of prioritized sampling
+    evaluate_on : str
+        After what type of event beta shoud be updated periodically. Possible values: 'action', 'episode', 'epoch'.
+    periodicity : int
+        How many [evaluateOn] are necessary before an update of beta occurs
+    """
+
+    def __init__(self, initial_beta=0.4, beta_growths=100000, beta_max=1., evaluate_on='action', periodicity=1):
+        """Initializer.
+        """
+
+        super(self.__class__, self).__init__()
+        self._count = 0
+        self._init_beta = initial_beta
+        self._beta = initial_beta
+        self._beta_max = beta_max
+        self._beta_growth = (beta_max - initial_beta) / beta_growths
+        self._periodicity = periodicity
+
+        self._on_action = 'action' == evaluate_on
+        self._on_episode = 'episode' == evaluate_on
+        self._on_epoch = 'epoch' == evaluate_on
+        if not self._on_action and not self._on_episode and not self._on_epoch:
+            self._on_action = True
+
+    def onStart(self, agent):
+        if (self._active == False):
+            return
+
+        self._count = 0
+        agent.setImportanceSamplingExponent(self._init_beta)
+        self._beta = self._init_beta
+
+    def onEpisodeEnd(self, agent, terminal_reached, reward):
+        if (self._active == False):
+            return
+
+        if self._on_episode:
+            self._update(agent)
+
+    def onEpochEnd(self, agent):
+        if (self._active == False):
+            return
+
+        if self._on_epoch:
+            self._update(agent)
+
+    def onActionChosen(self, agent, action):
+        if (self._active == False):
+            return
+
+        if self._on_action:
+            self._update(agent)
+
+    def _update(self, agent):
+        self._count += 1
+        if self._periodicity <= 1 or self._count % self._periodicity == 0:
+            agent.setImportanceSamplingExponent(self._beta)
+            self._beta = min(self._beta + self._beta_growth, self._beta_max)
+
+
 class DiscountFactorController(Controller):
     """A controller that modifies the q-network discount periodically.
     More informations in : Francois-Lavet Vincent et al. (2015) - How to Discount Deep Reinforcement Learning: Towards New Dynamic Strategies (http://arxiv.org/abs/1512.02011).
@@ -562,6 +634,62 @@ class FindBestController(Controller):
         joblib.dump({"vs": self._validationScores, "ts": self._testScores}, basename + "_scores.jldump")
 
 
+class StepLogController(Controller):
+    """A controller that flushes the per-step records of the environment (see helper.instrumentation) to disk
+    periodically, so that the simulator never writes to a file inside a step. The environment should provide a
+    flush_log() method, as TransplanSimulator does.
+
+    Parameters
+    ----------
+    evaluate_on : str
+        After what type of event the records should be flushed periodically. Possible values: 'episode', 'epoch'.
+    periodicity : int
+        How many [evaluateOn] are necessary before a flush occurs
+    """
+
+    def __init__(self, evaluate_on='epoch', periodicity=1):
+        """Initializer.
+        """
+
+        super(self.__class__, self).__init__()
+        self._count = 0
+        self._periodicity = periodicity
+
+        self._on_episode = 'episode' == evaluate_on
+        self._on_epoch = not self._on_episode
+
+    def onStart(self, agent):
+        if (self._active == False):
+            return
+
+        self._count = 0
+
+    def onEpisodeEnd(self, agent, terminal_reached, reward):
+        if (self._active == False):
+            return
+
+        if self._on_episode:
+            self._update(agent)
+
+    def onEpochEnd(self, agent):
+        if (self._active == False):
+            return
+
+        if self._on_epoch:
+            self._update(agent)
+
+    def onEnd(self, agent):
+        if (self._active == False):
+            return
+
+        agent._environment.flush_log()
+
+    def _update(self, agent):
+        self._count += 1
+        if self._periodicity <= 1 or self._count % self._periodicity == 0:
+            agent._environment.flush_log()
+
+
 
 if __name__ == "__main__":
     pass
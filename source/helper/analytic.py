@@ -0,0 +1,80 @@
+import numpy as np
+
+
+# Closed-form (or deterministic quadrature) counterparts of the sampled quantities of TransplanSimulator.
+# Response time is Gaussian and floored at min_response_time in the reward, work time is Pareto clipped
+# to [scale, cap] as in helpers.synthesize.
+
+def erf(x):
+    """
+        Vectorized error function (Abramowitz and Stegun 7.1.26, absolute error below 1.5e-7)
+    """
+    x = np.asarray(x, dtype=float)
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1 / (1 + 0.3275911 * x)
+    y = 1 - (((((1.061405429 * t - 1.453152027) * t) + 1.421413741) * t - 0.284496736) * t + 0.254829592) * t * np.exp(-x * x)
+    return sign * y
+
+def normal_cdf(x, mean=0, std=1):
+    return 0.5 * (1 + erf((np.asarray(x) - mean) / (std * np.sqrt(2))))
+
+def expected_inverse_floored_gaussian(mean, std, floor, n_points=4097):
+    """
+        E[1 / max(X, floor)] for X ~ N(mean, std). The part below the floor is P(X <= floor) / floor, the part
+        above is the truncated Gaussian expectation of 1 / X, integrated with the trapezoidal rule.
+    """
+    upper = max(floor, mean) + 12 * std
+    x = np.linspace(floor, upper, n_points)
+    y = np.exp(-0.5 * ((x - mean) / std) ** 2) / (std * np.sqrt(2 * np.pi)) / x
+    return normal_cdf(floor, mean, std) / floor + np.sum((y[1:] + y[:-1]) * np.diff(x)) / 2
+
+def clipped_pareto_moment(shape, scale, cap, k):
+    """
+        E[min(X, cap) ** k] for X Pareto with minimum scale and tail index shape
+    """
+    if k == shape:
+        body = shape * scale ** shape * np.log(cap / scale)
+    else:
+        body = shape * scale ** shape * (cap ** (k - shape) - scale ** (k - shape)) / (k - shape)
+    return body + cap ** k * (scale / cap) ** shape
+
+def expected_work_time_penalty(shape, scale, cap, lower_bound, upper_bound):
+    """
+        E[(W - lower_bound) * (W - upper_bound)] for W Pareto clipped to [scale, cap]
+    """
+    first = clipped_pareto_moment(shape, scale, cap, 1)
+    second = clipped_pareto_moment(shape, scale, cap, 2)
+    return second - (lower_bound + upper_bound) * first + lower_bound * upper_bound
+
+def total_time_cdf(mean, std, shape, scale, cap, n_points=1024):
+    """
+        CDF of R + W for R ~ N(mean, std) and W Pareto clipped to [scale, cap], tabulated on a grid.
+        W is discretized on geometric bins of its continuous part plus its atom at cap.
+
+        Returns
+        -------
+        t : grid of total times
+        cdf : P(R + W <= t)
+    """
+    edges = np.geomspace(scale, cap, n_points + 1)
+    survival = (scale / edges) ** shape
+    weights = np.append(survival[:-1] - survival[1:], survival[-1])
+    w = np.append(np.sqrt(edges[:-1] * edges[1:]), cap)
+
+    t = np.linspace(mean + scale - 8 * std, mean + cap + 8 * std, n_points)
+    cdf = normal_cdf(t[:, None] - w[None, :], mean, std) @ weights
+    return t, np.maximum.accumulate(cdf)
+
+def quantile_from_cdf(t, cdf, level):
+    return np.interp(level, cdf, t)
+
+
+if __name__ == "__main__":
+    rng = np.random.default_rng(123456)
+    r = rng.normal(0.1, 117, 1000000)
+    w = np.clip((rng.pareto(0.825, 1000000) + 1) * 9, 9, 180)
+    print (np.mean(1 / np.maximum(r, 74)), expected_inverse_floored_gaussian(0.1, 117, 74))
+    print (np.mean((w - 9) * (w - 90)), expected_work_time_penalty(0.825, 9, 180, 9, 90))
+    t, cdf = total_time_cdf(0.1, 117, 0.825, 9, 180)
+    print (np.quantile(r + w, 0.99), quantile_from_cdf(t, cdf, 0.99))
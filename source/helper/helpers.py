@@ -1,5 +1,7 @@
 import numpy as np
 
+from interface.ActionSpace import ActionSpace
+
 
 # Based on the histogram, working time on translations is inline with Exponential / Pareto Distribution
 # This function synthesize distributions(i.e. Pareto, Gaussian)
@@ -7,15 +9,65 @@ import numpy as np
 def synthesize(dist="Gaussian", sample_size=1000, parameters={}, random_generator=None):
 
     if not random_generator:
-        random_generator = np.random.RandomState(123456)
+        random_generator = np.random.default_rng(123456)
     if dist == "Gaussian":
-        sample = random_generator.normal(parameters['mean'], parameters['std'], sample_size)
+        # Same samples as random_generator.normal, which is slower when the mean is an array (one per sample)
+        sample = random_generator.standard_normal(sample_size) * parameters['std'] + parameters['mean']
     elif dist == "Pareto":
         sample = (random_generator.pareto(parameters['shape'], sample_size) + 1) * parameters['scale']
         # Truncate the long tail to avoid large neagtive reward
         sample = np.clip(sample, parameters['scale'], parameters['scale'] * 20)
     return sample
 
+"""
+This function computes the reward averaged over the translation strings and the total time of one step.
+The reward of each string is success_rate * (1 / max(response_time, min_response_time) - 
+(work_time - lower_bound) * (work_time - upper_bound)), and the time of the step is the maximum of 
+response_time + work_time over all strings.
+"""
+def reward_and_time(response_time, work_time, success_rate, min_response_time, work_time_lower_bound, work_time_upper_bound):
+    reward = success_rate * (1 / np.maximum(response_time, min_response_time) - 
+                             (work_time - work_time_lower_bound) * (work_time - work_time_upper_bound))
+    total_time = response_time + work_time
+    return reward.sum() / response_time.shape[0], total_time.max()
+
+"""
+Reference implementation of reward_and_time with row-wise pandas operations.
+It is slow and only kept to check the numpy kernel against it.
+"""
+def reward_and_time_pandas(response_time, work_time, success_rate, min_response_time, work_time_lower_bound, work_time_upper_bound):
+    import pandas as pd
+
+    df = pd.DataFrame(data={"response_time": response_time, "work_time": work_time})
+    df['reward'] = df.apply(lambda row: success_rate * 
+                                        ((1 / max(row['response_time'], min_response_time)) - 
+                                        (row['work_time'] - work_time_lower_bound) * 
+                                        (row['work_time'] - work_time_upper_bound)), axis=1)
+    reward = df['reward'].sum() / len(df)
+    df['total_time'] = df.apply(lambda row: row['response_time'] + row['work_time'], axis=1)
+    return reward, df['total_time'].max()
+
+"""
+This function checks that reward_and_time and reward_and_time_pandas give the same numbers
+on synthesized samples. It returns the largest relative difference over all trials.
+"""
+def check_reward_and_time(n_trials=10, sample_size=100, rtol=1e-9, random_generator=None):
+    if not random_generator:
+        random_generator = np.random.default_rng(123456)
+    max_diff = 0
+    for _ in range(n_trials):
+        response_time = synthesize("Gaussian", sample_size, {"mean": 0.1, "std": 117}, random_generator)
+        work_time = synthesize("Pareto", sample_size, {"shape": 0.825, "scale": 9}, random_generator)
+        success_rate = random_generator.uniform(0.5, 1)
+        args = (response_time, work_time, success_rate, 74, 9, 90)
+        expected = np.array(reward_and_time_pandas(*args))
+        actual = np.array(reward_and_time(*args))
+        diff = np.max(np.abs(actual - expected) / np.maximum(np.abs(expected), 1e-12))
+        if diff > rtol:
+            raise AssertionError("Numpy and pandas engines differ: {} != {}".format(actual, expected))
+        max_diff = max(max_diff, diff)
+    return max_diff
+
 """
 This function parses [constituency (0, 1), candidate (0, 1, 2), voting (0, 1), cost]
        [Constituency, Candidate, Voting]
@@ -25,51 +77,14 @@ This function parses [constituency (0, 1), candidate (0, 1, 2), voting (0, 1), c
 ...
 110-119 => [1, 2, 1]
 
+It reads the lookup table of the default ActionSpace, see ActionSpace.decode to parse batches of actions.
 """
+_ACTION_SPACE = ActionSpace()
+
 def parse_action(action):
-    if action == 120:
-        import pdb; pdb.set_trace();
-    result = [0, 0, 0, 0]
-    
-    # Cost is the last digit of action number
-    result[3] = action % 10
-    action = action // 10
-    if action == 0:
-        pass
-    elif action == 1:
-        result[2] = 1
-    elif action == 2:
-        result[1] = 1
-    elif action == 3:
-        result[2] = 1
-        result[1] = 1
-    elif action == 4:
-        result[1] = 2
-    elif action == 5:
-        result[2] = 1
-        result[1] = 2
-    elif action == 6:
-        result[0] = 1
-    elif action == 7:
-        result[0] = 1
-        result[2] = 1
-    elif action == 8:
-        result[1] = 1
-        result[0] = 1
-    elif action == 9:
-        result[0] = 1
-        result[1] = 1
-        result[2] = 1
-    elif action == 10:
-        result[1] = 2
-        result[0] = 1
-    elif action == 11:
-        result[2] = 1
-        result[1] = 2
-        result[0] = 1
-    
-    return result[0], result[1], result[2], result[3]
+    constituency, candidate, voting, cost = _ACTION_SPACE.components[action].tolist()
+    return constituency, candidate, voting, cost
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    print ("Max relative difference between engines : ", check_reward_and_time())
\ No newline at end of file
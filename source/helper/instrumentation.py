@@ -0,0 +1,88 @@
+import json
+
+import numpy as np
+
+
+# Per-step diagnostics of a simulator, kept in a preallocated ring buffer and written to disk in bulk.
+
+STEP_RECORD_DTYPE = np.dtype([("episode", np.int64),
+                              ("step", np.int32),
+                              ("success_rate", np.float64),
+                              ("reward", np.float64),
+                              ("time", np.float64),
+                              ("money", np.float64),
+                              ("terminal", np.bool_)])
+
+# Levels of instrumentation
+LOG_OFF = 0     # Nothing is recorded, the simulator does not call the recorder at all
+LOG_STEPS = 1   # Every step is recorded in the ring buffer
+LOG_PRINT = 2   # Every step is recorded and printed on stdout
+
+class StepRecorder(object):
+    """
+        Ring buffer of per-step records (episode, step, success rate, reward, time spent, money spent, terminal flag).
+
+        Parameters
+        ----------
+        capacity: number of records kept in memory. When the buffer is full, it is flushed to path if one is given,
+                  otherwise the oldest records are overwritten.
+        path: file the records are appended to by flush()
+        format: "jsonl" (one JSON object per line) or "binary" (raw STEP_RECORD_DTYPE records, read back with
+                np.fromfile(path, dtype=STEP_RECORD_DTYPE))
+    """
+    def __init__(self, capacity=4096, path=None, format="jsonl"):
+        if format not in ("jsonl", "binary"):
+            raise Exception('The format ' + format + ' is not implemented.')
+        self._records = np.zeros(capacity, dtype=STEP_RECORD_DTYPE)
+        self._capacity = capacity
+        self._cur = 0
+        self._n_elems = 0
+        self.path = path
+        self.format = format
+
+    def record(self, episode, step, success_rate, reward, time, money, terminal):
+        if self._n_elems == self._capacity and self.path is not None:
+            self.flush()
+        self._records[self._cur] = (episode, step, success_rate, reward, time, money, terminal)
+        self._cur = (self._cur + 1) % self._capacity
+        self._n_elems = min(self._n_elems + 1, self._capacity)
+
+    def records(self):
+        """
+            Returns the records currently in memory, ordered by time
+        """
+        start = (self._cur - self._n_elems) % self._capacity
+        return np.roll(self._records, -start)[:self._n_elems]
+
+    def clear(self):
+        self._cur = 0
+        self._n_elems = 0
+
+    def flush(self, path=None):
+        """
+            Appends the records currently in memory to path (self.path by default) and clears them.
+            Returns the number of records written.
+        """
+        path = path or self.path
+        records = self.records()
+        if path is None or len(records) == 0:
+            return 0
+
+        if self.format == "binary":
+            with open(path, "ab") as f:
+                records.tofile(f)
+        else:
+            names = records.dtype.names
+            lines = [json.dumps(dict(zip(names, row.tolist()))) for row in records]
+            with open(path, "a") as f:
+                f.write("\n".join(lines) + "\n")
+
+        self.clear()
+        return len(records)
+
+    def __len__(self):
+        return self._n_elems
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,141 @@
+import os
+import csv
+from datetime import datetime
+
+import numpy as np
+
+from helper.helpers import synthesize
+
+
+# Samplers of response time and work time used by the simulators.
+# A sampler provides response_time(size, cost, random_generator) and work_time(size, cost, scale, random_generator),
+# where cost is the price of the job in cents and scale the lower bound of work time. Cost and scale may be arrays
+# broadcastable to size, so that one call draws the samples of a whole batch of work orders.
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "data", "EXP2_data", "CSV")
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "transplanrl")
+
+class ParametricSampler(object):
+    """
+        Gaussian response times and Pareto work times synthesized by helpers.synthesize
+
+        Parameters
+        ----------
+        std: standard deviation of response time
+        shape: shape of the Pareto distribution of work time
+    """
+    def __init__(self, std=117, shape=0.825):
+        self.std = std
+        self.shape = shape
+
+    def response_time(self, size, cost, random_generator):
+        return synthesize(dist="Gaussian",
+                          sample_size=size,
+                          parameters={"mean": 1 / np.asarray(cost, dtype=float), "std": self.std},
+                          random_generator=random_generator)
+
+    def work_time(self, size, cost, scale, random_generator):
+        return synthesize(dist="Pareto",
+                          sample_size=size,
+                          parameters={"shape": self.shape, "scale": scale},
+                          random_generator=random_generator)
+
+
+class EmpiricalSampler(object):
+    """
+        Response times and work times drawn from the MTurk logs of one locale (data/EXP2_data/CSV).
+
+        Work time is the WorkTimeInSeconds column. Response time is the time between two consecutive
+        AcceptTime of the batch, i.e. how long a job waits for the next worker. Each price (3 and 5 cents)
+        is parsed once and cached on disk as float32 .npy files. Samples are drawn by inverse-CDF lookup
+        on quantile tables, with a single searchsorted per batch. A job of another price uses the table
+        of the closest price in the logs.
+
+        Parameters
+        ----------
+        locale: locale of the logs, e.g. "en-gb"
+        prices: prices in cents available in the logs
+        n_quantiles: number of points of the quantile tables
+        truncate: whether work time is truncated to [scale, 20 * scale] like the Pareto samples
+        data_dir: directory of the CSV logs
+        cache_dir: directory of the .npy cache
+    """
+    def __init__(self, locale="en-gb", prices=(3, 5), n_quantiles=1024, truncate=True, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+        self.locale = locale.lower().replace("_", "-")
+        self.prices = np.asarray(prices, dtype=float)
+        self.truncate = truncate
+        self._probabilities = np.linspace(0, 1, n_quantiles)
+
+        response_tables = []
+        work_tables = []
+        for price in prices:
+            response_time, work_time = load_mturk_times(self.locale, price, data_dir, cache_dir)
+            response_tables.append(np.quantile(response_time, self._probabilities))
+            work_tables.append(np.quantile(work_time, self._probabilities))
+        self._response_tables = np.array(response_tables, dtype=np.float32)
+        self._work_tables = np.array(work_tables, dtype=np.float32)
+        # The closest price of a cost is found by a binary search among the midpoints of the sorted prices
+        self._price_order = np.argsort(self.prices, kind="stable")
+        sorted_prices = self.prices[self._price_order]
+        self._price_midpoints = (sorted_prices[1:] + sorted_prices[:-1]) / 2
+
+    def _closest_price(self, cost):
+        cost = np.asarray(cost, dtype=float)
+        return self._price_order[np.searchsorted(self._price_midpoints, cost, side="left")]
+
+    def _sample(self, tables, table_index, size, random_generator):
+        u = random_generator.uniform(0, 1, size)
+        k = np.clip(np.searchsorted(self._probabilities, u, side="right"), 1, len(self._probabilities) - 1)
+        p_low = self._probabilities[k - 1]
+        fraction = (u - p_low) / (self._probabilities[k] - p_low)
+        low = tables[table_index, k - 1]
+        return low + fraction * (tables[table_index, k] - low)
+
+    def response_time(self, size, cost, random_generator):
+        return self._sample(self._response_tables, self._closest_price(cost), size, random_generator)
+
+    def work_time(self, size, cost, scale, random_generator):
+        sample = self._sample(self._work_tables, self._closest_price(cost), size, random_generator)
+        if self.truncate:
+            sample = np.clip(sample, scale, np.asarray(scale) * 20)
+        return sample
+
+
+def _parse_time(value):
+    # e.g. "Mon Jul 15 11:54:35 PDT 2019", the time zone token is dropped
+    parts = value.split()
+    return datetime.strptime(" ".join(parts[:4] + parts[5:]), "%a %b %d %H:%M:%S %Y").timestamp()
+
+"""
+This function returns (response_time, work_time) float32 arrays of one locale and price.
+The CSV file is parsed once and both arrays are cached in cache_dir, the cache is refreshed if the CSV file is newer.
+"""
+def load_mturk_times(locale, price, data_dir=DATA_DIR, cache_dir=CACHE_DIR):
+    name = "{}-{}cents".format(locale, int(price))
+    csv_path = os.path.join(data_dir, name + ".csv")
+    cache_paths = [os.path.join(cache_dir, name + "-response.npy"), os.path.join(cache_dir, name + "-work.npy")]
+
+    if all(os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(csv_path) for path in cache_paths):
+        return np.load(cache_paths[0]), np.load(cache_paths[1])
+
+    accept_times = []
+    work_times = []
+    with open(csv_path, encoding="utf-8", errors="replace", newline="") as f:
+        for row in csv.DictReader(f):
+            accept_times.append(_parse_time(row["AcceptTime"]))
+            work_times.append(float(row["WorkTimeInSeconds"]))
+
+    response_time = np.diff(np.sort(np.array(accept_times))).astype(np.float32)
+    work_time = np.array(work_times, dtype=np.float32)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    np.save(cache_paths[0], response_time)
+    np.save(cache_paths[1], work_time)
+    return response_time, work_time
+
+
+if __name__ == "__main__":
+    sampler = EmpiricalSampler("en-gb")
+    rng = np.random.default_rng(123456)
+    print (sampler.response_time(10, 3, rng))
+    print (sampler.work_time(10, 3, 9, rng))
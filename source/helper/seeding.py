@@ -0,0 +1,95 @@
+import json
+import zlib
+
+import numpy as np
+
+
+class ExperimentSeeds(object):
+    """
+        Independent random streams (numpy.random.Generator) for the components of one experiment, all derived
+        from a single experiment seed.
+
+        The stream of a component only depends on the experiment seed and on the name of the component, not on
+        the order in which components are created. Workers or sub-environments of one component get independent
+        streams with SeedSequence.spawn. The initial state of every stream is kept for the run metadata, so that
+        any stream can be rebuilt with restore_generator() to replay an episode.
+
+        Parameters
+        ----------
+        seed: int, the experiment seed. If None, fresh entropy is drawn from the OS and recorded in the metadata.
+    """
+    def __init__(self, seed=None):
+        self._root = np.random.SeedSequence(seed)
+        self._streams = {}
+
+    @property
+    def entropy(self):
+        return self._root.entropy
+
+    def _sequence(self, name):
+        # Stable key derived from the name, so that streams do not depend on the creation order
+        return np.random.SeedSequence(self._root.entropy, spawn_key=(zlib.crc32(name.encode()),))
+
+    def generator(self, name):
+        """
+            Returns the Generator of component name. The same generator is returned on later calls.
+        """
+        if name not in self._streams:
+            sequence = self._sequence(name)
+            generator = np.random.Generator(np.random.PCG64(sequence))
+            self._streams[name] = (sequence, generator, generator.bit_generator.state)
+        return self._streams[name][1]
+
+    def generators(self, name, n):
+        """
+            Returns n independent Generators spawned from the stream of component name, e.g. one per worker
+            or sub-environment. Worker i is registered as "name/i".
+        """
+        children = self._sequence(name).spawn(n)
+        generators = []
+        for i, sequence in enumerate(children):
+            generator = np.random.Generator(np.random.PCG64(sequence))
+            self._streams["{}/{}".format(name, i)] = (sequence, generator, generator.bit_generator.state)
+            generators.append(generator)
+        return generators
+
+    def sequences(self, name, n):
+        """
+            Returns n SeedSequences spawned from the stream of component name. They can be sent to
+            worker processes, which build their own Generator from them.
+        """
+        children = self._sequence(name).spawn(n)
+        for i, sequence in enumerate(children):
+            self._streams["{}/{}".format(name, i)] = (sequence, None, None)
+        return children
+
+    def metadata(self, current_state=False):
+        """
+            Returns a JSON-serializable description of the streams: experiment entropy, spawn key of every
+            stream and the state of its bit generator (initial state, or current state if current_state is True).
+        """
+        streams = {}
+        for name, (sequence, generator, initial_state) in self._streams.items():
+            streams[name] = {"spawn_key": list(sequence.spawn_key)}
+            if generator is not None:
+                streams[name]["state"] = generator.bit_generator.state if current_state else initial_state
+        return {"entropy": self._root.entropy, "streams": streams}
+
+    def save(self, path, current_state=False):
+        with open(path, "w") as f:
+            json.dump(self.metadata(current_state), f, indent=2)
+
+
+"""
+This function rebuilds a Generator from a state recorded in the metadata of ExperimentSeeds.
+"""
+def restore_generator(state):
+    bit_generator = getattr(np.random, state["bit_generator"])()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+
+if __name__ == "__main__":
+    seeds = ExperimentSeeds(123456)
+    print (seeds.generator("simulator").random(3))
+    print (restore_generator(seeds.metadata()["streams"]["simulator"]["state"]).random(3))
@@ -1,162 +1,140 @@
+import operator
+
 import numpy as np
 
-class Node:
-    def __init__(self, position=-1, priority=0, end=-1):
-        self.left = None
-        self.right = None
-        self.parent = None
-        self.position = position
-        self.priority = priority
-        self.end = end
-
-    def hasChildren(self):
-        if (self.right == None and self.left == None):
-            return False
-        return True
-
-class SumTree:
+class SegmentTree:
+    """
+        Complete binary tree stored in a flat array: node i has children 2i and 2i+1, the root is node 1 and the
+        leaf of index is node capacity + index, capacity being the smallest power of two >= size.
+        Every inner node holds operation(left child, right child); unused leaves hold neutral.
+        scalar_operation is the same operation on Python floats, much cheaper for single updates.
+    """
+    def __init__(self, size, operation, neutral, scalar_operation):
+
+        self._size = size
+        self._capacity = 1
+        while (self._capacity < size):
+            self._capacity *= 2
+        self._depth = int(np.log2(self._capacity))
+        self._operation = operation
+        self._scalar_operation = scalar_operation
+        self._neutral = neutral
+        self._tree = np.full(2 * self._capacity, neutral, dtype='float64')
+
+    def update(self, index, priority):
+
+        node = self._capacity + index
+        self._tree[node] = priority
+        node //= 2
+        while (node >= 1):
+            self._tree[node] = self._scalar_operation(self._tree[2 * node], self._tree[2 * node + 1])
+            node //= 2
+
+    def updateBatch(self, indices, priorities):
+
+        nodes = self._capacity + np.asarray(indices)
+        self._tree[nodes] = priorities
+        # One level at a time, each parent is recomputed once
+        for _ in range(self._depth):
+            nodes = np.unique(nodes // 2)
+            self._tree[nodes] = self._operation(self._tree[2 * nodes], self._tree[2 * nodes + 1])
+
+    def getPriority(self, index):
+        return self._tree[self._capacity + np.asarray(index)]
+
+    def priorities(self):
+        return self._tree[self._capacity:self._capacity + self._size]
+
+    def root(self):
+        return self._tree[1]
+
+class SumTree(SegmentTree):
     def __init__(self, size):
-        
-        self._root = Node()
-        size_left = int(size/2)
-        # Initialization of the tree
-        self._root.left = self._createSubtree(self._root, 0, size_left) # [a,b[
-        self._root.right = self._createSubtree(self._root, size_left, size)
-        self._max_priority = 1
 
-    def _createSubtree(self, parent, begin, end):
-        
-        n_elem = end - begin
-        if (n_elem == 1):
-             node = Node(position=begin)
-             node.parent = parent
-             node.end = end
-             return node
-
-        # At least 2 values (leaves) left
-        mid = int((end + begin)/2)
-        node = Node(end=end)
-        node.parent = parent
-        node.left = self._createSubtree(node, begin, mid)
-        node.right = self._createSubtree(node, mid, end)
-        return node
+        SegmentTree.__init__(self, size, np.add, 0., operator.add)
+        self._max_priority = 1
 
     def update(self, index, priority=-1):
-        
+
         if (priority == -1):
             priority = self._max_priority
         elif (priority > self._max_priority):
             self._max_priority = priority
 
-        # Search for index
-        node = self.findIndex(index)
-
-        # Replace with new priority
-        diff = priority - node.priority
-        node.priority = priority
-
-        # Update value
-        self._updateValue(node.parent, diff)
+        SegmentTree.update(self, index, priority)
 
-    def _updateValue(self, node, diff):
-        node.priority += diff
-        if (node.parent != None):
-            self._updateValue(node.parent, diff)
+        return priority
 
-    def findIndex(self, index):
-        
-        if(self._root != None):
-            return self._findIndex(index, self._root)
-        else:
-            return None
+    def updateBatch(self, indices, priorities):
 
-    def _findIndex(self, index, node):
-        if (node.position == index):
-            return node
+        priorities = np.asarray(priorities, dtype='float64')
+        if (len(priorities) > 0):
+            self._max_priority = max(self._max_priority, np.max(priorities))
+        SegmentTree.updateBatch(self, indices, priorities)
 
-        if (index < node.left.end):
-            return self._findIndex(index, node.left)
-        else:
-            return self._findIndex(index, node.right)
+    def total(self):
+        return self.root()
 
     def getBatch(self, n, rng, dataset):
-        
-        pmax = self._root.priority
+
+        # One priority drawn uniformly in each of the n strata of [0, total]
+        pmax = self.total()
         step = pmax / n
-        indices = np.zeros(n, dtype='int32')
-        for i in range(n):
-            p = rng.uniform(i*step, (i+1)*step)
-            node = self.find(p)
-            index = self._checkTerminal(node.position, dataset)
-            if (index >= 0):
-                indices[i] = index
-            else:
-                return np.zeros(0)
-
-        return indices
-
-    def _checkTerminal(self, index, dataset):
-        
-        history_size = dataset._max_history_size
-        terminals = dataset._terminals
-        n_elems = dataset.n_elems
-
-        lower_bound = history_size - 1
-
-        # Check if the index is valid wrt terminals
-        first_try = index
-        start_wrapped = False
-        while True:
-            i = index - 1
-            processed = 0
-            for _ in range(history_size - 1):
-                if (i < 0 or terminals[i]):
-                    break
-
-                i -= 1
-                processed += 1
-
-            if (processed < history_size - 1):
-                # if we stopped prematurely, shift slice to the left and try again
-                index = i
-                if (index < lower_bound):
-                    start_wrapped = True
-                    index = n_elems - 1
-                if (start_wrapped and index <= first_try):
-                    return -1
-            else:
-                # else index was ok according to terminals
-                return index
-
-    def find(self, priority):
-        
-        if(self._root != None):
-            return self._find(priority, self._root)
-        else:
-            return None
-
-    def _find(self, priority, node):
-        if (not node.hasChildren()):
-            return node
-
-        if(priority <= node.left.priority):
-            return self._find(priority, node.left)
-        else:
-            return self._find(priority - node.left.priority, node.right)
+        priorities = (np.arange(n) + rng.random(n)) * step
+        indices = self.find(priorities)
+        indices = self._checkTerminal(indices, dataset)
+        if (np.any(indices < 0)):
+            return np.zeros(0)
+
+        return indices.astype('int32')
+
+    def _checkTerminal(self, indices, dataset):
+
+        # Leaves of the closest transitions with a full history at or before the ones of indices (wrapping around to 
+        # the end of the replay memory)
+        replay_indices = dataset._actions.getIndices(indices)
+        replay_indices = dataset._nearestValidStateIndices(replay_indices, dataset._max_history_size)
+        if (np.any(replay_indices < 0)):
+            return replay_indices
+        return dataset._actions.getSlots(replay_indices)
+
+    def find(self, priorities):
+        """
+            Descends the tree for all priorities at once and returns the index of the leaf where each one falls
+        """
+        priorities = np.array(priorities, dtype='float64', ndmin=1)
+        nodes = np.ones(len(priorities), dtype='int64')
+        for _ in range(self._depth):
+            left = 2 * nodes
+            left_priorities = self._tree[left]
+            go_left = priorities <= left_priorities
+            priorities = np.where(go_left, priorities, priorities - left_priorities)
+            nodes = np.where(go_left, left, left + 1)
+        # Rounding errors can lead past the last used leaf
+        return np.minimum(nodes - self._capacity, self._size - 1)
 
     def printTree(self):
     # Classical printout method. Mostly for debugging purposes.
-        if(self._root != None):
-            self._printTree(self._root)
+        for index, priority in enumerate(self.priorities()):
+            print(index, priority)
 
         print("===============")
 
-    def _printTree(self, node):
-        if(node != None):
-            self._printTree(node.left)
-            print(node.position, node.priority)
-            self._printTree(node.right)
-        
+class MinTree(SegmentTree):
+    """
+        Minimum of the priorities, e.g. for the largest importance sampling weight of prioritized replay
+    """
+    def __init__(self, size):
+
+        SegmentTree.__init__(self, size, np.minimum, np.inf, min)
+
+    def min(self):
+        return self.root()
+
 
 if __name__ == "__main__":
-    pass
+    sum_tree = SumTree(10)
+    min_tree = MinTree(10)
+    sum_tree.updateBatch(np.arange(10), np.arange(1, 11))
+    min_tree.updateBatch(np.arange(10), np.arange(1, 11))
+    print (sum_tree.total(), min_tree.min(), sum_tree.find([0.5, 1.5, 54.9, 55]))
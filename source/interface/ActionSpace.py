@@ -1,10 +1,63 @@
-from enum import Enum, auto
+import numpy as np
 
-class ActionSpace(Enum):
+class ActionSpace(object):
     '''
+        Factored discrete action space. An action id is the mixed-radix number of its sub-actions
+        [sub-action 1, ..., sub-action k, cost], the cost level being the last digit.
+        Lookup tables are precomputed for all ids: decoded components, success-rate multiplier,
+        cost in cents and validity, so that batches of ids are decoded with one indexing operation.
+
         Parameters:
-            actions : list of the name of actions
+            rate_vectors : list of (name, rates) where rates[i] multiplies the success rate when choice i of
+                           the sub-action is taken
+            cost_range : cost in cents of each cost level
+            invalid : list of dicts {name: choice} describing the combinations of sub-actions that are invalid
     '''
-    def __init__(self, actions):
-        for action in actions:
-            action = auto()
\ No newline at end of file
+    def __init__(self, rate_vectors=(("constituency", [0.8, 1]),
+                                     ("candidate", [1, 0.8, 1.2]),
+                                     ("voting", [0.8, 1])),
+                       cost_range=list(range(1, 11)),
+                       invalid=({"constituency": 1, "candidate": 1},)):
+        self.names = [name for name, _ in rate_vectors] + ["cost"]
+        self.shape = tuple(len(rates) for _, rates in rate_vectors) + (len(cost_range),)
+        self.n = int(np.prod(self.shape))
+        self._strides = dict(zip(self.names, np.cumprod((self.shape + (1,))[::-1])[::-1][1:].tolist()))
+
+        # components[action] = [choice of each sub-action]
+        self.components = np.stack(np.unravel_index(np.arange(self.n), self.shape), axis=1)
+
+        self.success_rate = np.ones(self.n)
+        for i, (_, rates) in enumerate(rate_vectors):
+            self.success_rate = self.success_rate * np.asarray(rates, dtype=float)[self.components[:, i]]
+
+        self.cost = np.asarray(cost_range, dtype=float)[self.components[:, -1]]
+
+        self.valid = np.ones(self.n, dtype=bool)
+        for combination in invalid:
+            match = np.ones(self.n, dtype=bool)
+            for name, choice in combination.items():
+                match &= self.components[:, self.names.index(name)] == choice
+            self.valid &= ~match
+
+    def __len__(self):
+        return self.n
+
+    def decode(self, actions):
+        """
+            Returns the components of the action ids, with size [..., number of sub-actions]
+        """
+        return self.components[actions]
+
+    def encode(self, components):
+        """
+            Returns the action ids of components with size [..., number of sub-actions]
+        """
+        return np.ravel_multi_index(tuple(np.moveaxis(np.asarray(components), -1, 0)), self.shape)
+
+    def replace(self, actions, name, choices):
+        """
+            Returns the action ids where the choice of sub-action name is replaced by choices
+        """
+        stride = self._strides[name]
+        current = self.components[actions, self.names.index(name)]
+        return actions + (np.asarray(choices) - current) * stride
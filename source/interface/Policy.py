@@ -11,7 +11,7 @@ class Policy(object):
         -----------
         learning_algo: object from class Algorithm
         actions: (int) Number of actions in the action space provided by Simulator.get_num_action()
-        random_state: numpy random generator by certain distribution
+        random_state: numpy.random.Generator
     """
 
     def __init__(self, learning_algo, actions, random_state):
@@ -30,14 +30,43 @@ class Policy(object):
         """
             This function returns a random action to explore unknown area
         """
-        action = self.random_state.randint(0, self.actions)
+        action = self.random_state.integers(0, self.actions)
         value = 0
         return action, value
 
+    def batch_best_action(self, states, mode=None, *args, **kwargs):
+        """
+            This function returns the best actions for a batch of states. states[i] is the batch
+            of input i, so that the state of row j is [states[i][j] for each input i].
+            Learning algorithms providing get_best_action_batch evaluate the whole batch at once.
+        """
+        if hasattr(self.learning_algo, "get_best_action_batch"):
+            return self.learning_algo.get_best_action_batch(states, mode, *args, **kwargs)
+        actions = np.zeros(len(states[0]), dtype=int)
+        values = np.zeros(len(states[0]))
+        for j in range(len(actions)):
+            actions[j], values[j] = self.best_action([s[j] for s in states], mode, *args, **kwargs)
+        return actions, values
+
+    def batch_random_action(self, n):
+        """
+            This function returns n random actions to explore unknown area
+        """
+        return self.random_state.integers(0, self.actions, n), np.zeros(n)
+
     def action(self, state):
         """
             This function should be called by agent, given a state, and should return a valid 
             action to the simulator provided to the constructor
         """
         raise NotImplementedError()
-    
+
+    def batch_action(self, states, mode=None, *args, **kwargs):
+        """
+            Batched version of action(), called by agent when driving a vectorized simulator
+        """
+        actions = np.zeros(len(states[0]), dtype=int)
+        values = np.zeros(len(states[0]))
+        for j in range(len(actions)):
+            actions[j], values[j] = self.action([s[j] for s in states], mode, *args, **kwargs)
+        return actions, values
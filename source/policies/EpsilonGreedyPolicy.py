@@ -13,12 +13,22 @@ class EpsilonGreedyPolicy(Policy):
         self._epsilon = epsilon
     
     def action(self, state, mode=None, *args, **kwargs):
-        if self.random_state.rand() < self._epsilon:
+        if self.random_state.random() < self._epsilon:
             action, value = self.random_action()
         else:
             action, value = self.best_action(state, mode, *args, **kwargs)
 
         return action, value
+
+    def batch_action(self, states, mode=None, *args, **kwargs):
+        n = len(states[0])
+        explore = self.random_state.random(n) < self._epsilon
+        actions, values = self.batch_random_action(n)
+        if not explore.all():
+            greedy = ~explore
+            actions[greedy], values[greedy] = self.batch_best_action([s[greedy] for s in states], mode, *args, **kwargs)
+
+        return actions, values
     
     def setEpsilon(self, e):
         self._epsilon = e
@@ -1,18 +1,44 @@
 # This script runs the training process of TransplanRL
 
+import argparse
+
 import numpy as np
 
 from NeuralAgent import NeuralAgent
-from algorithms.q_net_keras import QNetwork
 from TransplanSimulator import TransplanSimulator
+from LocaleSimulatorPool import LocaleSimulatorPool
+from policies import EpsilonGreedyPolicy
+from helper.seeding import ExperimentSeeds
 import experiment.base_controllers as bc
 
-rng = np.random.RandomState(123456)
+# Every component gets its own random stream derived from the experiment seed
+seeds = ExperimentSeeds(123456)
+
+def q_network_class(backend="keras"):
+    """
+        Learning algorithm of the backend. Keras is only imported when it is used, so that the NumPy backend starts
+        without loading a deep-learning framework.
+    """
+    if backend == "numpy":
+        from algorithms.q_net_numpy import NumpyQNetwork
+        return NumpyQNetwork
+    elif backend == "keras":
+        from algorithms.q_net_keras import QNetwork
+        return QNetwork
+    raise Exception('The backend ' + backend + ' is not implemented.')
+
+def run(backend="keras"):
+    QNetwork = q_network_class(backend)
+    simulator = TransplanSimulator(seeds.generator("simulator"))
+    q_network = QNetwork(environment=simulator, random_state=seeds.generator("q_network"))
+    num_actions = simulator.get_num_actions()
+    agent = NeuralAgent(environment=simulator,
+                        learning_algo=q_network,
+                        random_state=seeds.generator("replay_memory"),
+                        train_policy=EpsilonGreedyPolicy(q_network, num_actions, seeds.generator("train_policy"), 0.1),
+                        test_policy=EpsilonGreedyPolicy(q_network, num_actions, seeds.generator("test_policy"), 0.))
+    seeds.save("run_metadata.json")
 
-def run():
-    simulator = TransplanSimulator(rng)
-    q_network = QNetwork(environment=simulator, random_state=rng)
-    agent = NeuralAgent(environment=simulator, learning_algo=q_network, random_state=rng)
     agent.attach(bc.VerboseController())
     agent.attach(bc.TrainerController())
     agent.attach(bc.InterleavedTestEpochController(
@@ -22,5 +48,35 @@ def run():
     agent.run(n_epochs=100, epoch_length=100)
 
 
+def run_locales(n_epochs=100, epoch_length=10, envs_per_locale=64, backend="keras"):
+    """
+        Trains against the five locales of the MTurk logs at once, one worker process per locale.
+        Every step of the pool yields 5 * envs_per_locale transitions.
+    """
+    QNetwork = q_network_class(backend)
+    pool = LocaleSimulatorPool(envs_per_locale=envs_per_locale, seed_sequences=seeds.sequences("locale_pool", 5))
+    q_network = QNetwork(environment=pool, random_state=seeds.generator("q_network"))
+    num_actions = pool.get_num_actions()
+    agent = NeuralAgent(environment=pool,
+                        learning_algo=q_network,
+                        random_state=seeds.generator("replay_memory"),
+                        train_policy=EpsilonGreedyPolicy(q_network, num_actions, seeds.generator("train_policy"), 0.1),
+                        test_policy=EpsilonGreedyPolicy(q_network, num_actions, seeds.generator("test_policy"), 0.))
+    seeds.save("run_metadata.json")
+
+    agent.attach(bc.TrainerController(show_episode_avg_V_value=False, show_avg_Bellman_residual=False))
+    for epoch in range(n_epochs):
+        n_episodes = agent.runVectorized(pool, epoch_length)
+        print("Epoch {}: {} episodes ended".format(epoch + 1, n_episodes))
+    pool.close()
+
+
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Trains TransplanRL")
+    parser.add_argument("--backend", default="keras", choices=["keras", "numpy"], help="implementation of the Q-network")
+    parser.add_argument("--locales", action="store_true", help="train against the simulator pool of all locales")
+    args = parser.parse_args()
+    if args.locales:
+        run_locales(backend=args.backend)
+    else:
+        run(backend=args.backend)
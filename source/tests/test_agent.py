@@ -0,0 +1,53 @@
+import numpy as np
+
+from NeuralAgent import NeuralAgent
+from VectorTransplanSimulator import VectorTransplanSimulator
+from algorithms.q_net_numpy import NumpyQNetwork
+from experiment import base_controllers as controllers
+
+
+class RecordingSimulator(VectorTransplanSimulator):
+    """ Keeps the rewards and terminal masks of every step """
+    def __init__(self, *args, **kwargs):
+        self.rewards, self.terminals = [], []
+        super(RecordingSimulator, self).__init__(*args, **kwargs)
+
+    def act(self, actions):
+        rewards = VectorTransplanSimulator.act(self, actions)
+        self.rewards.append(rewards)
+        self.terminals.append(self.inTerminalState().copy())
+        return rewards
+
+
+class ActionRecorder(controllers.Controller):
+    def __init__(self):
+        super(ActionRecorder, self).__init__()
+        self.actions = []
+
+    def onActionChosen(self, agent, action):
+        self.actions.append(action)
+
+
+def test_run_vectorized_in_test_mode_counts_episodes_and_values():
+    num_envs, n_steps = 8, 30
+    simulator = RecordingSimulator(np.random.default_rng(0), num_envs=num_envs)
+    q_network = NumpyQNetwork(simulator, random_state=np.random.default_rng(1))
+    agent = NeuralAgent(simulator, q_network, random_state=np.random.default_rng(2))
+    recorder = ActionRecorder()
+    agent.attach(recorder)
+
+    agent.startMode(0, n_steps)
+    n_terminals = agent.runVectorized(simulator, n_steps)
+
+    terminals = np.array(simulator.terminals)
+    assert n_terminals == terminals.sum()
+    # Episodes still running after the last step are truncated, and counted as well
+    n_episodes = terminals[:-1].sum() + num_envs
+    mean_reward, count = agent.totalRewardOverLastTest()
+    assert count == n_episodes
+    assert np.isclose(mean_reward, np.sum(simulator.rewards) / n_episodes)
+
+    assert len(agent._Vs_on_last_episode) == n_steps
+    assert agent.avgEpisodeVValue() != 0
+    assert len(recorder.actions) == n_steps * num_envs
+    assert all(np.ndim(action) == 0 for action in recorder.actions)
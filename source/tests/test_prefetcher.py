@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from NeuralAgent import DataSet, BatchPrefetcher, SliceError
+from test_replay_memory import Env, fill
+
+
+def add_samples(dataset, n, rng):
+    for _ in range(n):
+        dataset.addSample([np.float32(0), np.zeros(2, dtype='float32')], rng.integers(10), rng.normal(), rng.random() < 0.1, 1)
+
+
+def test_nstep_returns_match_their_batch_while_samples_are_added():
+    dataset = DataSet(Env(), np.random.default_rng(4), max_size=150)
+    nstep, discount = 3, 0.9
+    fill(dataset, 300, seed=5)
+    rng = np.random.default_rng(6)
+    prefetcher = BatchPrefetcher(dataset, 32, 3, nstep, False, lambda: discount)
+    try:
+        for _ in range(30):
+            observations, actions, rewards, terminals, indices, returns, bootstrap = prefetcher.get()
+            # The buffer is full: every sample added shifts the relative indices of the batches waiting
+            assert np.allclose(returns, np.sum(rewards * discount ** np.arange(nstep), axis=1))
+            assert np.array_equal(bootstrap, np.logical_not(terminals[:, -1]))
+            add_samples(dataset, 7, rng)
+    finally:
+        prefetcher.close()
+
+
+def test_priority_updates_apply_in_order_and_skip_overwritten_transitions():
+    dataset = DataSet(Env(), np.random.default_rng(7), max_size=150, use_priority=True)
+    fill(dataset, 300, seed=8)
+    prefetcher = BatchPrefetcher(dataset, 32, 2, use_priority=True)
+    try:
+        # Batches are reused by the prefetcher once the next one is requested
+        first = [np.array(a) for a in prefetcher.get()[-1]]
+        second = [np.array(a) for a in prefetcher.get()[-1]]
+        dataset.updatePriorities(np.full(32, 2.), first[1], first[3])
+        dataset.updatePriorities(np.full(32, 3.), second[1], second[3])
+        only_first = np.setdiff1d(first[1], second[1])
+        assert np.all(dataset._priorities[second[1]] == 3.)
+        assert np.all(dataset._priorities[only_first] == 2.)
+
+        third = [np.array(a) for a in prefetcher.get()[-1]]
+        fill(dataset, 150, seed=9)
+        dataset.updatePriorities(np.full(32, 5.), third[1], third[3])
+        assert not np.any(dataset._priorities == 5.)
+    finally:
+        prefetcher.close()
+
+
+def test_errors_sampled_before_the_buffer_is_big_enough_are_dropped():
+    dataset = DataSet(Env(), np.random.default_rng(10), max_size=150)
+    fill(dataset, 2)
+    prefetcher = BatchPrefetcher(dataset, 32, 3)
+    try:
+        with pytest.raises(SliceError):
+            prefetcher.get()
+        fill(dataset, 100, seed=11)
+        for _ in range(5):
+            assert len(prefetcher.get()[1]) == 32
+    finally:
+        prefetcher.close()
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("keras")
+
+from keras.optimizers import SGD
+from keras.models import Model
+from keras.layers import Input, Dense, Flatten, Concatenate
+
+from algorithms.q_net_keras import QNetwork
+from algorithms.DQN import DQN
+
+
+class Env(object):
+    def get_action_dimension(self):
+        return [(1,), (2, 2)]
+
+    def get_num_actions(self):
+        return 6
+
+
+def batch(rng, n=8):
+    states = np.zeros(2, dtype='object')
+    next_states = np.zeros(2, dtype='object')
+    for i, dim in enumerate(Env().get_action_dimension()):
+        states[i] = rng.normal(size=(n,) + dim).astype('float32')
+        next_states[i] = rng.normal(size=(n,) + dim).astype('float32')
+    return states, rng.integers(0, 6, n), rng.normal(size=n).astype('float32'), next_states, rng.random(n) < 0.3
+
+
+@pytest.mark.parametrize("double_Q", [False, True])
+def test_masked_loss_step_matches_full_output_step(double_Q):
+    """ The full-output update of the previous QNetwork.train (mean square error over all the actions, with the
+    predicted Q-values as targets except for the action taken) has the gradient of the masked loss divided by the 
+    number of actions: one SGD step of each, with the learning rate rescaled, gives the same weights. """
+    rng = np.random.default_rng(0)
+    q_network = QNetwork(Env(), update_rule="sgd", random_state=np.random.default_rng(1), double_Q=double_Q)
+    states, actions, rewards, next_states, terminals = batch(rng)
+    initial_weights = q_network.q_vals.get_weights()
+
+    q_network.train(states, actions, rewards, next_states, terminals)
+    masked_weights = q_network.q_vals.get_weights()
+
+    q_network.q_vals.set_weights(initial_weights)
+    q_network.q_vals.compile(optimizer=SGD(learning_rate=q_network.get_learning_rate() * 6), loss='mse')
+    batch_range = np.arange(len(actions))
+    next_q_vals = q_network.next_q_vals.predict_on_batch(next_states.tolist())
+    if double_Q:
+        best = np.argmax(q_network.q_vals.predict_on_batch(next_states.tolist()), axis=1)
+    else:
+        best = np.argmax(next_q_vals, axis=1)
+    target = rewards + ~terminals * q_network.get_discount_factor() * next_q_vals[batch_range, best]
+    q_vals = q_network.q_vals.predict_on_batch(states.tolist())
+    q_vals[batch_range, actions] = target
+    q_network.q_vals.train_on_batch(states.tolist(), q_vals)
+    full_output_weights = q_network.q_vals.get_weights()
+
+    assert any(not np.allclose(w, w0) for w, w0 in zip(masked_weights, initial_weights))
+    for w, w_full in zip(masked_weights, full_output_weights):
+        assert np.allclose(w, w_full, rtol=1e-4, atol=1e-6)
+
+
+def test_mirror_matches_keras_model():
+    rng = np.random.default_rng(2)
+    q_network = QNetwork(Env(), random_state=np.random.default_rng(3))
+    states, actions, rewards, next_states, terminals = batch(rng)
+    q_network.train(states, actions, rewards, next_states, terminals)
+    best_actions, values = q_network.get_best_action_batch(list(states))
+    q_vals = q_network.q_vals.predict_on_batch(states.tolist())
+    assert np.array_equal(best_actions, np.argmax(q_vals, axis=1))
+    assert np.allclose(values, np.max(q_vals, axis=1), rtol=1e-5, atol=1e-5)
+
+
+class TanhNetwork(DQN):
+    """ Dense network with a tanh activation, which the NumPy mirror does not reproduce """
+    def _buildDQN(self):
+        inputs = [Input(shape=dim) for dim in self._action_dimension]
+        x = Dense(50, activation='tanh')(Concatenate()([Flatten()(input) for input in inputs]))
+        model = Model(inputs=inputs, outputs=Dense(self._num_actions)(x))
+        return model, [param for layer in model.layers for param in layer.trainable_weights]
+
+
+def test_custom_network_falls_back_to_keras():
+    rng = np.random.default_rng(4)
+    q_network = QNetwork(Env(), random_state=np.random.default_rng(5), neural_network=TanhNetwork)
+    states = batch(rng)[0]
+    best_actions, values = q_network.get_best_action_batch(list(states))
+    q_vals = q_network.q_vals.predict_on_batch(states.tolist())
+    assert not q_network._use_mirror
+    assert np.array_equal(best_actions, np.argmax(q_vals, axis=1))
+    assert np.allclose(values, np.max(q_vals, axis=1))
@@ -0,0 +1,63 @@
+import numpy as np
+
+from algorithms.q_net_numpy import NumpyQNetwork
+
+
+class Env(object):
+    def get_action_dimension(self):
+        return [(1,), (2, 2)]
+
+    def get_num_actions(self):
+        return 6
+
+
+def batch(rng, n=8):
+    states = np.zeros(2, dtype='object')
+    next_states = np.zeros(2, dtype='object')
+    for i, dim in enumerate(Env().get_action_dimension()):
+        states[i] = rng.normal(size=(n,) + dim)
+        next_states[i] = rng.normal(size=(n,) + dim)
+    return states, rng.integers(0, 6, n), rng.normal(size=n), next_states, rng.random(n) < 0.3
+
+
+def test_gradients_match_finite_differences():
+    rng = np.random.default_rng(0)
+    q_network = NumpyQNetwork(Env(), random_state=np.random.default_rng(1), double_Q=True, hidden_units=(7, 5))
+    q_network.params = [p.astype('float64') for p in q_network.params]
+    q_network.next_params = [p + 0.01 * rng.normal(size=p.shape) for p in q_network.params]
+    states, actions, rewards, next_states, terminals = batch(rng)
+    weights = rng.random(len(actions))
+    x, next_x = q_network._inputs(states).astype('float64'), q_network._inputs(next_states).astype('float64')
+    batch_range = np.arange(len(actions))
+
+    def loss(params):
+        # Double Q target: online network chooses, target network evaluates
+        best = np.argmax(q_network._forward(params, next_x)[0], axis=1)
+        target = rewards + ~terminals * q_network.get_discount_factor() * q_network._forward(q_network.next_params, next_x)[0][batch_range, best]
+        q_vals = q_network._forward(params, x)[0]
+        return np.mean(weights * (q_vals[batch_range, actions] - target) ** 2), target
+
+    value, target = loss(q_network.params)
+    q_vals, activations = q_network._forward(q_network.params, x)
+    delta = np.zeros_like(q_vals)
+    delta[batch_range, actions] = 2 * weights * (q_vals[batch_range, actions] - target) / len(actions)
+    grads = q_network._backward(activations, delta)
+
+    epsilon = 1e-6
+    for k, param in enumerate(q_network.params):
+        for index in zip(*[rng.integers(0, s, 4) for s in param.shape]):
+            shifted = [p.copy() for p in q_network.params]
+            shifted[k][index] += epsilon
+            assert np.isclose((loss(shifted)[0] - value) / epsilon, grads[k][index], rtol=1e-3, atol=1e-6)
+
+
+def test_training_fits_a_fixed_batch():
+    rng = np.random.default_rng(2)
+    q_network = NumpyQNetwork(Env(), random_state=np.random.default_rng(3))
+    q_network.set_discount_factor(0.)
+    states, actions, rewards, next_states, terminals = batch(rng)
+    first_loss, _ = q_network.train(states, actions, rewards, next_states, terminals)
+    for _ in range(500):
+        loss, loss_ind = q_network.train(states, actions, rewards, next_states, terminals)
+    assert loss < 0.1 * first_loss
+    assert loss_ind.shape == (len(actions),)
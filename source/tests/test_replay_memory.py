@@ -0,0 +1,95 @@
+import numpy as np
+import pytest
+
+from NeuralAgent import DataSet, COMPACT_STORAGE
+
+
+class Env(object):
+    """ Histories of 3 scalars and of 2 vectors of size 2 """
+    def get_action_dimension(self):
+        return [(3,), (2, 2)]
+
+    def get_num_actions(self):
+        return 10
+
+    def observationType(self, subject):
+        return "float32"
+
+
+def fill(dataset, n, seed=0):
+    """ Adds n samples whose observations hold their absolute index t (exact in float16 for t < 2048), returns the
+    reference terminals, actions, rewards and steps since terminal by absolute index. """
+    rng = np.random.default_rng(seed)
+    terminals, since_terminal = [], []
+    episode_left = rng.integers(1, 9)
+    for t in range(n):
+        episode_left -= 1
+        terminals.append(episode_left == 0)
+        since_terminal.append(0 if t == 0 or terminals[t - 1] else since_terminal[t - 1] + 1)
+        dataset.addSample([np.float32(t), np.array([t, -t], dtype='float32')], t % 10, (t % 16) * 0.25, terminals[t], 1)
+        if episode_left == 0:
+            episode_left = rng.integers(1, 9)
+    t = np.arange(n)
+    return np.array(terminals), t % 10, (t % 16) * 0.25, np.array(since_terminal)
+
+def observation_windows(ends, length):
+    """ Reference observations of the windows of length punctual observations ending at ends (absolute indices) """
+    ids = ends[:, None] + np.arange(1 - length, 1)[None, :]
+    return ids.astype(float), np.stack([ids, -ids], axis=-1).astype(float)
+
+
+@pytest.mark.parametrize("storage", [None, COMPACT_STORAGE])
+def test_random_batch_after_wrap_around(storage):
+    dataset = DataSet(Env(), np.random.default_rng(1), max_size=150, storage=storage)
+    n = 500
+    terminals, actions, rewards, since_terminal = fill(dataset, n)
+    first = n - dataset.n_elems
+
+    for _ in range(20):
+        states, batch_actions, batch_rewards, next_states, batch_terminals, indices = dataset.randomBatch(32, False)
+        absolute = first + indices
+        # Only transitions with a full history, never the last one (it has no next state)
+        assert np.all(since_terminal[absolute] >= 2)
+        assert np.all(absolute < n - 1)
+        assert np.array_equal(batch_actions, actions[absolute])
+        assert np.array_equal(batch_rewards, rewards[absolute])
+        assert np.array_equal(batch_terminals, terminals[absolute])
+
+        scalars, vectors = observation_windows(absolute, 3)
+        assert np.array_equal(states[0], scalars)
+        assert np.array_equal(states[1], vectors[:, 1:])
+        next_scalars, next_vectors = observation_windows(absolute + 1, 3)
+        next_scalars[terminals[absolute]] = 0
+        next_vectors[terminals[absolute]] = 0
+        assert np.array_equal(next_states[0], next_scalars)
+        assert np.array_equal(next_states[1], next_vectors[:, 1:])
+
+
+@pytest.mark.parametrize("storage", [None, COMPACT_STORAGE])
+def test_random_batch_nstep_and_returns_after_wrap_around(storage):
+    dataset = DataSet(Env(), np.random.default_rng(2), max_size=150, storage=storage)
+    n, nstep, discount = 500, 3, 0.9
+    terminals, actions, rewards, since_terminal = fill(dataset, n, seed=3)
+    first = n - dataset.n_elems
+
+    for _ in range(20):
+        observations, batch_actions, batch_rewards, batch_terminals, indices = dataset.randomBatch_nstep(32, nstep, False)
+        absolute = first + indices
+        # The nstep transitions ending at absolute and the history of the first one are in the same trajectory
+        assert np.all(since_terminal[absolute] >= 3 + nstep - 2)
+        steps = absolute[:, None] + np.arange(1 - nstep, 1)[None, :]
+        assert np.array_equal(batch_actions, actions[steps])
+        assert np.array_equal(batch_rewards, rewards[steps])
+        assert np.array_equal(batch_terminals, terminals[steps])
+
+        scalars, vectors = observation_windows(absolute + 1, 3 + nstep)
+        scalars[terminals[absolute], -1] = 0
+        vectors[terminals[absolute], -1] = 0
+        assert np.array_equal(observations[0], scalars)
+        assert np.array_equal(observations[1], vectors[:, 1:])
+
+        expected_returns = np.sum(rewards[steps] * discount ** np.arange(nstep), axis=1)
+        for use_cache in (False, True, True):
+            returns, bootstrap = dataset.nstepReturns(indices, nstep, discount, use_cache=use_cache)
+            assert np.allclose(returns, expected_returns)
+            assert np.array_equal(bootstrap, ~terminals[absolute])
@@ -0,0 +1,32 @@
+import numpy as np
+
+from helper.tree import SumTree, MinTree
+
+
+def test_sum_tree_total_and_find_match_cumulative_sums():
+    rng = np.random.default_rng(0)
+    size = 37
+    sum_tree = SumTree(size)
+    min_tree = MinTree(size)
+    priorities = rng.random(size) + 0.01
+    sum_tree.updateBatch(np.arange(size), priorities)
+    min_tree.updateBatch(np.arange(size), priorities)
+    # Single and batch updates, with repeated leaves in the batch (the last value wins)
+    for index in rng.integers(0, size, 10):
+        priorities[index] = rng.random() + 0.01
+        sum_tree.update(index, priorities[index])
+        min_tree.update(index, priorities[index])
+    indices = np.array([3, 5, 3, 30])
+    values = rng.random(len(indices)) + 0.01
+    sum_tree.updateBatch(indices, values)
+    min_tree.updateBatch(indices, values)
+    priorities[indices] = values
+
+    assert np.isclose(sum_tree.total(), priorities.sum())
+    assert min_tree.min() == priorities.min()
+    assert np.array_equal(sum_tree.priorities(), priorities)
+
+    cumulative = np.cumsum(priorities)
+    queries = np.concatenate([rng.random(1000) * cumulative[-1], cumulative[:-1] + 1e-9, [0., cumulative[-1]]])
+    expected = np.minimum(np.searchsorted(cumulative, queries), size - 1)
+    assert np.array_equal(sum_tree.find(queries), expected)